@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from foodgram.caches import is_shared
+
+token_key = 'auth_token:{}'
+
+
+def get_cache():
+    """
+    None when tokens are not cached: with a process-local backend
+    logout in one worker would leave the token cached by the others
+    """
+    if is_shared(settings.TOKEN_CACHE) or settings.TOKEN_CACHE_SINGLE_PROCESS:
+        return caches[settings.TOKEN_CACHE]
+    return None
+
+
+def forget_tokens(keys):
+    """Runs after commit, so other workers can't cache the old user again"""
+    cache = get_cache()
+    if cache is not None:
+        keys = [token_key.format(key) for key in keys]
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def forget_user_tokens(user_id):
+    forget_tokens(
+        Token.objects.filter(user_id=user_id).values_list('key', flat=True)
+    )
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication, which keeps token with snapshot of its user
+    in cache, so authenticated requests skip Token and User query.
+    Entries live for TOKEN_CACHE timeout and are dropped when token
+    is deleted or user is saved. Needs a shared cache backend, see
+    TOKEN_CACHE_SINGLE_PROCESS.
+    """
+
+    def authenticate_credentials(self, key):
+        cache = get_cache()
+        if cache is None:
+            return super().authenticate_credentials(key)
+        cache_key = token_key.format(key)
+        token = cache.get(cache_key)
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set(cache_key, token)
+        return token.user, token
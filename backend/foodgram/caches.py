@@ -0,0 +1,12 @@
+from django.conf import settings
+
+# backends keeping entries inside the worker process or not at all
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_shared(alias):
+    """Entries of the cache alias are seen by all worker processes"""
+    return settings.CACHES[alias]['BACKEND'] not in PROCESS_LOCAL_BACKENDS
@@ -0,0 +1,212 @@
+import functools
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """Cumulative histogram in Prometheus text format"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+    def lines(self, name, endpoint):
+        label = 'endpoint="{}"'.format(endpoint)
+        for bound, count in zip(self.buckets, self.counts):
+            yield '{}_bucket{{{},le="{}"}} {}'.format(name, label, bound,
+                                                      count)
+        yield '{}_bucket{{{},le="+Inf"}} {}'.format(name, label, self.count)
+        yield '{}_sum{{{}}} {}'.format(name, label, self.sum)
+        yield '{}_count{{{}}} {}'.format(name, label, self.count)
+
+
+class MetricsRegistry:
+    """Histograms of every metric by endpoint, kept by each worker process"""
+    metrics = {
+        'foodgram_request_queries': (
+            'SQL queries per request', QUERY_BUCKETS
+        ),
+        'foodgram_request_db_seconds': (
+            'Time spent in SQL queries', TIME_BUCKETS
+        ),
+        'foodgram_request_serialization_seconds': (
+            'Time spent in serializer.data', TIME_BUCKETS
+        ),
+        'foodgram_request_duration_seconds': (
+            'Total request time', TIME_BUCKETS
+        ),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {name: {} for name in self.metrics}
+
+    def observe(self, endpoint, values):
+        with self.lock:
+            for name, value in values.items():
+                histograms = self.histograms[name]
+                if endpoint not in histograms:
+                    _, buckets = self.metrics[name]
+                    histograms[endpoint] = Histogram(buckets)
+                histograms[endpoint].observe(value)
+
+    def exposition(self):
+        lines = []
+        with self.lock:
+            for name, (description, _) in self.metrics.items():
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} histogram'.format(name))
+                for endpoint, histogram in sorted(
+                    self.histograms[name].items()
+                ):
+                    lines.extend(histogram.lines(name, endpoint))
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class QueryRecorder:
+    """
+    Execute wrapper, counts queries and time spent in them.
+    With `keep_sql` counts every distinct statement too, repeated
+    parametrized queries are kept once.
+    """
+
+    def __init__(self, keep_sql):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter() if keep_sql else None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            if self.statements is not None:
+                self.statements[sql] += 1
+
+
+def endpoint_name(view_func, method):
+    """'RecipeViewSet.favorite' for DRF views, dotted path for others"""
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return '{}.{}'.format(view_func.__module__, view_func.__name__)
+    actions = getattr(view_func, 'actions', None) or {}
+    return '{}.{}'.format(view_class.__name__,
+                          actions.get(method.lower(), method.lower()))
+
+
+@functools.lru_cache(maxsize=None)
+def measured_serializer_class(serializer_class):
+    """Subclass adding time spent in `data` to the view's total"""
+    parent_data = serializer_class.data
+
+    def data(serializer):
+        start = time.perf_counter()
+        try:
+            return parent_data.fget(serializer)
+        finally:
+            serializer.context['view'].serialization_seconds += (
+                time.perf_counter() - start
+            )
+
+    return type(serializer_class.__name__, (serializer_class,),
+                {'data': property(data)})
+
+
+class SerializationMetricsMixin:
+    """
+    Times `data` of serializers made by `get_serializer()`
+    and passes the total to MetricsMiddleware with the response.
+    """
+    serialization_seconds = 0.0
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        serializer.__class__ = measured_serializer_class(
+            serializer.__class__
+        )
+        return serializer
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response,
+                                             *args, **kwargs)
+        response.serialization_seconds = self.serialization_seconds
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Records query count, DB time, serialization time and total time
+    of every request by view and action into `registry` histograms.
+    Requests with more than METRICS_QUERY_LOG_THRESHOLD queries are
+    logged with their distinct statements, 0 disables the log.
+    Should be the first middleware, so total time is measured closely.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.threshold = settings.METRICS_QUERY_LOG_THRESHOLD
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        request.metrics_endpoint = 'unresolved'
+        recorder = QueryRecorder(keep_sql=self.threshold > 0)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        self.record(request, response, recorder, start)
+        return response
+
+    def record(self, request, response, recorder, start):
+        registry.observe(request.metrics_endpoint, {
+            'foodgram_request_queries': recorder.count,
+            'foodgram_request_db_seconds': recorder.duration,
+            'foodgram_request_serialization_seconds': getattr(
+                response, 'serialization_seconds', 0
+            ),
+            'foodgram_request_duration_seconds': time.perf_counter() - start,
+        })
+        if self.threshold and recorder.count > self.threshold:
+            logger.warning(
+                '%s %s (%s) made %d queries:\n%s',
+                request.method, request.path, request.metrics_endpoint,
+                recorder.count, '\n'.join(
+                    '{} x {}'.format(count, sql)
+                    for sql, count in recorder.statements.most_common()
+                )
+            )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_endpoint = endpoint_name(view_func, request.method)
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, not proxied by nginx"""
+    return HttpResponse(registry.exposition(),
+                        content_type='text/plain; version=0.0.4')
@@ -42,6 +42,7 @@ AUTH_USER_MODEL = 'users.User'
 AUTHENTICATION_BACKENDS = ['django.contrib.auth.backends.ModelBackend']
 
 MIDDLEWARE = [
+    'foodgram.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,6 +83,80 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': env(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': env('CACHE_LOCATION', default='foodgram'),
+    },
+    'shopping_lists': {
+        'BACKEND': env(
+            'SHOPPING_LIST_CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': env(
+            'SHOPPING_LIST_CACHE_LOCATION',
+            default='foodgram-shopping-lists'
+        ),
+        'TIMEOUT': env.int('SHOPPING_LIST_CACHE_TIMEOUT', default=60 * 60),
+        'OPTIONS': {
+            'MAX_ENTRIES': env.int('SHOPPING_LIST_CACHE_MAX_ENTRIES',
+                                   default=500),
+        },
+    },
+    # must be shared by all workers (memcached, redis), see TOKEN_CACHE
+    'tokens': {
+        'BACKEND': env(
+            'TOKEN_CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': env('TOKEN_CACHE_LOCATION', default='foodgram-tokens'),
+        'TIMEOUT': env.int('TOKEN_CACHE_TIMEOUT', default=5 * 60),
+        'OPTIONS': {
+            'MAX_ENTRIES': env.int('TOKEN_CACHE_MAX_ENTRIES', default=10000),
+        },
+    },
+}
+
+SHOPPING_LIST_CACHE = 'shopping_lists'
+SHOPPING_LIST_CACHE_MAX_SIZE = 2 * 1024 * 1024
+
+TOKEN_CACHE = 'tokens'
+# Revoked tokens (logout, password change, deactivation) are evicted
+# from the cache of the worker, which handled the change, and from
+# a shared backend. A process-local one (LocMemCache, the default) keeps
+# them valid in other workers for up to TOKEN_CACHE_TIMEOUT, so then
+# tokens are not cached at all, unless the app runs in one process.
+TOKEN_CACHE_SINGLE_PROCESS = env.bool('TOKEN_CACHE_SINGLE_PROCESS',
+                                      default=False)
+
+INGREDIENT_SEARCH_LIMIT = 20
+RECIPE_SEARCH_LIMIT = 1000
+
+RECIPES_PREVIEW_LIMIT = 3
+RECIPES_PREVIEW_MAX_LIMIT = 50
+
+BATCH_MAX_SIZE = 100
+
+# users following at least that many authors get precomputed feed, 0 is off
+FEED_FANOUT_MIN_FOLLOWS = env.int('FEED_FANOUT_MIN_FOLLOWS', default=0)
+
+IMAGE_RENDITION_WORKERS = env.int('IMAGE_RENDITION_WORKERS', default=2)
+
+CATALOGUE_CACHE = 'default'
+CATALOGUE_MAX_AGE = 60
+# Catalogue and search index versions kept in a process-local
+# CATALOGUE_CACHE (LocMemCache, the default) miss changes made by other
+# processes, e.g. load_data or another worker, so they expire after
+# that many seconds. Versions in a shared backend never expire.
+CATALOGUE_LOCAL_VERSION_TIMEOUT = env.int('CATALOGUE_LOCAL_VERSION_TIMEOUT',
+                                          default=60)
+
+METRICS_QUERY_LOG_THRESHOLD = env.int('METRICS_QUERY_LOG_THRESHOLD',
+                                      default=50)
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -102,7 +177,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication'
+        'authentication.backends.CachedTokenAuthentication'
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -5,6 +5,7 @@ from django.urls import include, path
 from rest_framework import routers
 
 import authentication.urls
+from foodgram.metrics import metrics_view
 import users.urls
 from recipes.views import IngredientViewSet, RecipeViewSet, TagViewSet
 from users.views import UserViewSet
@@ -17,6 +18,7 @@ router.register('users', UserViewSet, basename='users')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('api/', include(router.urls)),
     path('api/', include(users.urls)),
     path('api/', include(authentication.urls)),
@@ -1,7 +1,10 @@
 from django.contrib import admin
 
+from .common.recipe_search import index_recipes
+from .common.renditions import schedule_renditions
 from .models import (FavoriteAndShoppingCart, Ingredient, IngredientAmount,
                      Recipe, Tag)
+from .signals import refresh_recipe_in_carts
 
 
 class IngredientAmountInline(admin.TabularInline):
@@ -27,28 +30,39 @@ class RecipeAdmin(admin.ModelAdmin):
         'get_tags',
         'image',
         'cooking_time',
-        'get_favorites'
+        'favorites_count',
+        'cart_count'
     )
     filter_horizontal = ('tags',)
     search_fields = ('author',)
     list_filter = ('author', 'name', 'tags', 'cooking_time')
     empty_value_display = '-'
     inlines = [IngredientAmountInline]
+    list_select_related = ('author',)
 
-    def get_tags(self, recipe):
-        tags_queryset = recipe.list_tags()
-        if tags_queryset:
-            return list(tags_queryset)
-        return None
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('tags')
 
-    def get_favorites(self, recipe):
-        favorites_queryset = recipe.is_favorited.count()
-        if favorites_queryset:
-            return favorites_queryset
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        index_recipes([form.instance.pk])
+        removed = [
+            ingredient_amount.ingredient_id
+            for formset in formsets
+            for ingredient_amount in formset.deleted_objects
+        ]
+        if removed:
+            refresh_recipe_in_carts(form.instance.pk, removed)
+        if 'image' in form.changed_data:
+            schedule_renditions(form.instance.pk)
+
+    def get_tags(self, recipe):
+        tags = [tag.name for tag in recipe.tags.all()]
+        if tags:
+            return tags
         return None
 
     get_tags.short_description = 'Теги'
-    get_favorites.short_description = 'Добавлено в избранное (раз)'
 
 
 @admin.register(Ingredient)
@@ -60,5 +74,17 @@ class IngredientAdmin(admin.ModelAdmin):
     empty_value_display = '-'
 
 
+@admin.register(IngredientAmount)
+class IngredientAmountAdmin(admin.ModelAdmin):
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        refresh_recipe_in_carts(obj.recipe_id, [obj.ingredient_id])
+
+    def delete_queryset(self, request, queryset):
+        deleted = list(queryset.values_list('recipe_id', 'ingredient_id'))
+        super().delete_queryset(request, queryset)
+        for recipe_id, ingredient_id in deleted:
+            refresh_recipe_in_carts(recipe_id, [ingredient_id])
+
+
 admin.site.register(FavoriteAndShoppingCart)
-admin.site.register(IngredientAmount)
@@ -0,0 +1,55 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from foodgram.caches import is_shared
+
+
+class CatalogueCache:
+    """
+    Serialized payload of rarely changed catalogue, kept in process.
+    Version lives in CATALOGUE_CACHE. With a shared backend a change
+    saved by one process invalidates copies kept by all of them.
+    A process-local backend sees only own changes, so there versions
+    expire after CATALOGUE_LOCAL_VERSION_TIMEOUT and copies are stale
+    for at most that long after a change made by another process.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.version_key = 'catalogue:{}:version'.format(name)
+        self.local = (None, None)
+
+    @property
+    def cache(self):
+        return caches[settings.CATALOGUE_CACHE]
+
+    @property
+    def timeout(self):
+        if is_shared(settings.CATALOGUE_CACHE):
+            return None
+        return settings.CATALOGUE_LOCAL_VERSION_TIMEOUT
+
+    def version(self):
+        version = self.cache.get(self.version_key)
+        if version is not None:
+            return version
+        self.cache.add(self.version_key, uuid.uuid4().hex, self.timeout)
+        return self.cache.get(self.version_key)
+
+    def bump(self):
+        self.cache.set(self.version_key, uuid.uuid4().hex, self.timeout)
+
+    def get(self, version):
+        local_version, payload = self.local
+        if local_version == version:
+            return payload
+        return None
+
+    def set(self, version, payload):
+        self.local = (version, payload)
+
+
+tags_catalogue = CatalogueCache('tags')
+ingredients_catalogue = CatalogueCache('ingredients')
@@ -0,0 +1,79 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import Greatest
+from django.utils.http import quote_etag
+
+from foodgram.caches import is_shared
+
+from .catalogue_cache import ingredients_catalogue, tags_catalogue
+
+viewer_key = 'viewer_state:{}'
+
+
+def get_cache():
+    return caches[settings.CATALOGUE_CACHE]
+
+
+def viewer_changed(user_ids):
+    """
+    Favorites, shopping cart or follows of the users changed, so did
+    flags in recipes they see. Runs after commit, like cache invalidation
+    of shopping lists.
+    """
+    transaction.on_commit(lambda: get_cache().set_many(
+        {viewer_key.format(user_id): time.time() for user_id in user_ids},
+        None
+    ))
+
+
+def viewer_changed_at(user):
+    """Time of the last change of user's flags, now if it is unknown"""
+    if not user.is_authenticated:
+        return 0
+    key = viewer_key.format(user.pk)
+    changed_at = get_cache().get(key)
+    if changed_at is not None:
+        return changed_at
+    get_cache().add(key, time.time(), None)
+    return get_cache().get(key)
+
+
+def recipes_etag(request, queryset):
+    """
+    Weak ETag of recipes in the queryset as seen by the request's user,
+    from one aggregate query. None when the queryset is empty, or the user
+    is authenticated and the viewer state is kept in a process-local
+    cache, which other workers don't update.
+    Counters are updated without touching `updated_at`, so their sums
+    are a part of it. There is no Last-Modified: deleted recipes and
+    renamed tags or ingredients don't move any modification time.
+    """
+    if (request.user.is_authenticated
+            and not is_shared(settings.CATALOGUE_CACHE)):
+        return None
+    state = queryset.order_by().aggregate(
+        modified=Max(Greatest('updated_at', 'author__updated_at')),
+        total=Count('pk'),
+        favorites=Sum('favorites_count'),
+        carts=Sum('cart_count')
+    )
+    if not state['total']:
+        return None
+    changed_at = viewer_changed_at(request.user)
+    digest = hashlib.sha1('|'.join(map(str, [
+        request.get_full_path(),
+        request.user.pk,
+        changed_at,
+        state['modified'].isoformat(),
+        state['total'],
+        state['favorites'],
+        state['carts'],
+        tags_catalogue.version(),
+        ingredients_catalogue.version(),
+    ])).encode()).hexdigest()
+    return 'W/' + quote_etag(digest)
@@ -0,0 +1,28 @@
+from django.db.models import Count, FloatField, Q
+from django.db.models.functions import Cast
+
+from recipes.models import IngredientAmount, Recipe
+
+
+def recipes_by_coverage(ingredient_ids, min_coverage=0):
+    """
+    (recipe id, coverage) rows of recipes having any of the ingredients,
+    coverage is the share of recipe ingredients among them. One grouped
+    query over ingredient amounts of candidate recipes, which are found
+    by (ingredient, recipe) unique index.
+    """
+    candidates = IngredientAmount.objects.filter(
+        ingredient__in=ingredient_ids
+    ).values('recipe')
+    return Recipe.objects.filter(pk__in=candidates).order_by().annotate(
+        covered=Count(
+            'ingredients', filter=Q(ingredients__ingredient__in=ingredient_ids)
+        ),
+        total=Count('ingredients'),
+    ).annotate(
+        coverage=Cast('covered', FloatField()) / Cast('total', FloatField())
+    ).filter(
+        coverage__gte=min_coverage
+    ).order_by(
+        '-coverage', '-covered', '-pub_date', '-id'
+    ).values_list('pk', 'coverage')
@@ -0,0 +1,82 @@
+import bisect
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+from recipes.models import Ingredient
+from .catalogue_cache import ingredients_catalogue
+
+
+class SortedPrefixIndex:
+    """
+    In-process index of lowercased ingredient names for databases
+    without trigram indexes (SQLite): prefix matches are found with
+    bisect in the sorted list, substring matches by scanning it.
+    Rebuilt when version of ingredients catalogue changes.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.names = None
+        self.ids = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        version = ingredients_catalogue.version()
+        with self.lock:
+            if self.version != version:
+                rows = sorted(
+                    Ingredient.objects.values_list('search_name', 'id')
+                )
+                self.ids = [pk for _, pk in rows]
+                self.names = [name for name, _ in rows]
+                self.version = version
+            return self.names, self.ids
+
+    def search(self, query, limit):
+        names, ids = self.load()
+        found = []
+        position = bisect.bisect_left(names, query)
+        while (position < len(names) and len(found) < limit
+               and names[position].startswith(query)):
+            found.append(ids[position])
+            position += 1
+        if len(found) < limit and query:
+            for name, pk in zip(names, ids):
+                if query in name and not name.startswith(query):
+                    found.append(pk)
+                    if len(found) == limit:
+                        break
+        return found
+
+
+prefix_index = SortedPrefixIndex()
+
+
+def search_ingredient_ids(query, limit):
+    """Ids of ingredients starting with query first, then containing it"""
+    if connection.vendor != 'postgresql':
+        return prefix_index.search(query, limit)
+    ingredients = Ingredient.objects.order_by('search_name', 'id')
+    found = list(ingredients.filter(
+        search_name__startswith=query
+    ).values_list('id', flat=True)[:limit])
+    if len(found) < limit and query:
+        found.extend(ingredients.filter(
+            search_name__contains=query
+        ).exclude(
+            search_name__startswith=query
+        ).values_list('id', flat=True)[:limit - len(found)])
+    return found
+
+
+def search_ingredients(query, limit=None):
+    """
+    Autocomplete search, prefix matches are ranked before substring ones
+    and the result is capped by INGREDIENT_SEARCH_LIMIT.
+    """
+    limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+    ids = search_ingredient_ids(query.strip().lower(), limit)
+    ingredients = Ingredient.objects.in_bulk(ids)
+    return [ingredients[pk] for pk in ids]
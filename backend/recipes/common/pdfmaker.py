@@ -1,36 +1,183 @@
-import io
 import os
+import threading
+import zlib
 
-from django.http import FileResponse
+from reportlab.lib.pagesizes import A4
 from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfgen import canvas
+from reportlab.pdfbase.ttfonts import (FF_NONSYMBOLIC, FF_SYMBOLIC, TTFont,
+                                       makeToUnicodeCMap)
 
 FONT_PATH = os.path.dirname(os.path.abspath(__file__))
 times_font = os.path.join(FONT_PATH, 'times.ttf')
 pdfmetrics.registerFont(TTFont('times', times_font))
 
+SUBSET_SIZE = 256
+# Objects written last, when all pages and used glyphs are known
+CATALOG, PAGES, RESOURCES = 1, 2, 3
 
-def pdf_shopping_list_maker(shopping_list):
-    """Creates pdf tamplate > printing strings > response pdf as attachment"""
+_subset_lock = threading.Lock()
+
+
+class StreamingPDF:
+    """
+    Minimal PDF writer, which returns every page as soon as it is drawn.
+    Text uses 256-glyph subsets of the embedded TrueType font,
+    like reportlab canvas does, so nothing but the used glyphs and
+    the page references is kept in memory until the document ends.
+    """
+
+    def __init__(self, font_name='times'):
+        self.face = pdfmetrics.getFont(font_name).face
+        self.subsets = []
+        self.codes = {}
+        self.offsets = {}
+        self.pages = []
+        self.position = 0
+        self.last_id = RESOURCES
+
+    def _reserve(self):
+        self.last_id += 1
+        return self.last_id
+
+    def _object(self, object_id, body):
+        self.offsets[object_id] = self.position
+        chunk = b'%d 0 obj\n%s\nendobj\n' % (object_id, body)
+        self.position += len(chunk)
+        return chunk
+
+    def _stream(self, object_id, content, extra=b''):
+        content = zlib.compress(content)
+        return self._object(object_id, (
+            b'<< /Length %d /Filter /FlateDecode %s>>\nstream\n%s\nendstream'
+        ) % (len(content), extra, content))
+
+    def start(self):
+        header = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+        self.position = len(header)
+        return header
+
+    def text(self, x, y, string, size):
+        """PDF operators drawing the string with the embedded font"""
+        runs = []
+        for char in string:
+            code = self.codes.get(char)
+            if code is None:
+                if not self.subsets or len(self.subsets[-1]) == SUBSET_SIZE:
+                    self.subsets.append([])
+                code = (len(self.subsets) - 1, len(self.subsets[-1]))
+                self.subsets[-1].append(ord(char))
+                self.codes[char] = code
+            if runs and runs[-1][0] == code[0]:
+                runs[-1][1].append(code[1])
+            else:
+                runs.append((code[0], [code[1]]))
+        operators = ['BT %.2f %.2f Td' % (x, y)]
+        for subset, codes in runs:
+            operators.append('/F%d %d Tf <%s> Tj' % (
+                subset, size, bytes(codes).hex()
+            ))
+        operators.append('ET')
+        return ' '.join(operators)
+
+    def page(self, operators):
+        """Writes the page content and returns the ready bytes"""
+        content_id = self._reserve()
+        page_id = self._reserve()
+        self.pages.append(page_id)
+        content = self._stream(content_id, '\n'.join(operators).encode())
+        page = self._object(page_id, (
+            b'<< /Type /Page /Parent %d 0 R /Resources %d 0 R '
+            b'/MediaBox [0 0 %.4f %.4f] /Contents %d 0 R >>'
+        ) % (PAGES, RESOURCES, A4[0], A4[1], content_id))
+        return content + page
+
+    def _font(self, number, subset):
+        face = self.face
+        base_font = 'AAAAA{}+{}'.format(
+            chr(ord('A') + number % 26), face.name.decode('latin-1')
+        )
+        with _subset_lock:
+            font_file = face.makeSubset(subset)
+        file_id, cmap_id = self._reserve(), self._reserve()
+        descriptor_id, font_id = self._reserve(), self._reserve()
+        chunks = [
+            self._stream(file_id, font_file, b'/Length1 %d ' % len(font_file)),
+            self._stream(
+                cmap_id, makeToUnicodeCMap(base_font, subset).encode()
+            ),
+            self._object(descriptor_id, (
+                '<< /Type /FontDescriptor /FontName /{} /Flags {} '
+                '/FontBBox [{}] /ItalicAngle {} /Ascent {} /Descent {} '
+                '/CapHeight {} /StemV {} /FontFile2 {} 0 R >>'
+            ).format(
+                base_font, face.flags & ~FF_NONSYMBOLIC | FF_SYMBOLIC,
+                ' '.join(str(value) for value in face.bbox),
+                face.italicAngle, face.ascent, face.descent,
+                face.capHeight, face.stemV, file_id
+            ).encode()),
+            self._object(font_id, (
+                '<< /Type /Font /Subtype /TrueType /BaseFont /{} '
+                '/FirstChar 0 /LastChar {} /Widths [{}] '
+                '/FontDescriptor {} 0 R /ToUnicode {} 0 R >>'
+            ).format(
+                base_font, len(subset) - 1,
+                ' '.join(str(face.getCharWidth(code)) for code in subset),
+                descriptor_id, cmap_id
+            ).encode()),
+        ]
+        return font_id, b''.join(chunks)
+
+    def finish(self):
+        """Fonts, page tree, catalog, cross-reference table and trailer"""
+        chunks, fonts = [], [b'/Helv << /Type /Font /Subtype /Type1 '
+                             b'/BaseFont /Helvetica >>']
+        for number, subset in enumerate(self.subsets):
+            font_id, chunk = self._font(number, subset)
+            fonts.append(b'/F%d %d 0 R' % (number, font_id))
+            chunks.append(chunk)
+        chunks.append(self._object(
+            RESOURCES, b'<< /Font << %s >> >>' % b' '.join(fonts)
+        ))
+        kids = b' '.join(b'%d 0 R' % page for page in self.pages)
+        chunks.append(self._object(
+            PAGES,
+            b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+                kids, len(self.pages)
+            )
+        ))
+        chunks.append(self._object(
+            CATALOG, b'<< /Type /Catalog /Pages %d 0 R >>' % PAGES
+        ))
+        size = self.last_id + 1
+        xref = [b'xref\n0 %d\n0000000000 65535 f \n' % size]
+        for object_id in range(1, size):
+            xref.append(b'%010d 00000 n \n' % self.offsets[object_id])
+        chunks.extend(xref)
+        chunks.append(b'trailer\n<< /Size %d /Root %d 0 R >>\n'
+                      b'startxref\n%d\n%%%%EOF\n' % (
+                          size, CATALOG, self.position))
+        return b''.join(chunks)
+
+
+def pdf_shopping_list_maker(rows):
+    """Creates pdf tamplate > printing strings > yields pdf page by page"""
     start_x = 72
     start_y = 700
-    buffer = io.BytesIO()
-    pdf = canvas.Canvas(buffer)
-    pdf.setFont('times', 24)
-    pdf.drawString(150, 800, "Список покупок Foodgram")
-    pdf.setFont('times', 16)
-    for ingredient, count in shopping_list.items():
-        pdf.drawString(start_x, start_y, ingredient.capitalize() + " " + count)
+    pdf = StreamingPDF()
+    yield pdf.start()
+    operators = [pdf.text(150, 800, "Список покупок Foodgram", 24)]
+    for name, amount, measurement_unit in rows:
+        line = '{} {} {}'.format(name.capitalize(), amount, measurement_unit)
+        operators.append(pdf.text(start_x, start_y, line, 16))
         start_y -= 30
         if start_y <= 40:
-            pdf.showPage()
+            yield pdf.page(operators)
+            operators = []
             start_y = 700
-            pdf.setFont('times', 16)
-    pdf.setFont('Helvetica', 14)
-    pdf.setFillColorRGB(1, 0, 0)
-    pdf.drawString(140, 20, "YASHCH with love to Yandex Praktikum Team <3")
-    pdf.showPage()
-    pdf.save()
-    buffer.seek(0)
-    return FileResponse(buffer, as_attachment=True, filename='foodgram.pdf')
+    operators.extend([
+        '1 0 0 rg',
+        'BT /Helv 14 Tf 140 20 Td '
+        '(YASHCH with love to Yandex Praktikum Team <3) Tj ET',
+    ])
+    yield pdf.page(operators)
+    yield pdf.finish()
@@ -0,0 +1,131 @@
+import bisect
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection, transaction
+from django.db.models import (Case, F, FloatField, OuterRef, Subquery, Value,
+                              When)
+from django.db.models.functions import Coalesce
+
+from recipes.models import IngredientAmount, Recipe
+from .catalogue_cache import CatalogueCache
+
+CONFIG = 'russian'
+TOKEN = re.compile(r'\w+')
+# weights of fields in ranking, same as default ts_rank weights
+# of A, B and C labels in search vector
+WEIGHTS = {'name': 1.0, 'ingredients': 0.4, 'text': 0.2}
+
+search_version = CatalogueCache('recipe_search')
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower().replace('ё', 'е'))
+
+
+class InvertedIndex:
+    """
+    In-process inverted index of recipe names, ingredient names and texts
+    for databases without full-text search (SQLite). Query words match
+    index words by prefix, all of them have to match. Rebuilt when
+    `search_version` changes.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.postings = None
+        self.words = None
+        self.lock = threading.Lock()
+
+    def build(self):
+        postings = defaultdict(dict)
+
+        def add(recipe_id, text, weight):
+            for word in tokenize(text):
+                scores = postings[word]
+                scores[recipe_id] = max(scores.get(recipe_id, 0), weight)
+
+        for pk, name, text in Recipe.objects.values_list(
+            'pk', 'name', 'text'
+        ).iterator():
+            add(pk, name, WEIGHTS['name'])
+            add(pk, text, WEIGHTS['text'])
+        for recipe_id, name in IngredientAmount.objects.values_list(
+            'recipe_id', 'ingredient__name'
+        ).iterator():
+            add(recipe_id, name, WEIGHTS['ingredients'])
+        return dict(postings)
+
+    def load(self):
+        version = search_version.version()
+        with self.lock:
+            if self.version != version:
+                self.postings = self.build()
+                self.words = sorted(self.postings)
+                self.version = version
+            return self.postings, self.words
+
+    def search(self, query, limit):
+        """Ids and scores of best matching recipes, best first"""
+        postings, words = self.load()
+        scores = None
+        for token in tokenize(query):
+            matched = {}
+            position = bisect.bisect_left(words, token)
+            while (position < len(words)
+                   and words[position].startswith(token)):
+                for pk, score in postings[words[position]].items():
+                    matched[pk] = max(matched.get(pk, 0), score)
+                position += 1
+            scores = matched if scores is None else {
+                pk: scores[pk] + score
+                for pk, score in matched.items() if pk in scores
+            }
+        return sorted((scores or {}).items(),
+                      key=lambda item: (-item[1], -item[0]))[:limit]
+
+
+inverted_index = InvertedIndex()
+
+
+def index_recipes(recipe_ids):
+    """
+    Updates search vectors of recipes after their name, text or
+    ingredients changed. Other databases rebuild inverted index lazily.
+    """
+    if connection.vendor != 'postgresql':
+        transaction.on_commit(search_version.bump)
+        return
+    names = IngredientAmount.objects.filter(
+        recipe=OuterRef('pk')
+    ).order_by().values('recipe').annotate(
+        names=StringAgg('ingredient__name', ' ')
+    ).values('names')
+    Recipe.objects.filter(pk__in=recipe_ids).update(search_vector=(
+        SearchVector('name', weight='A', config=CONFIG)
+        + SearchVector(Coalesce(Subquery(names), Value('')),
+                       weight='B', config=CONFIG)
+        + SearchVector('text', weight='C', config=CONFIG)
+    ))
+
+
+def search_recipes(queryset, query):
+    """Recipes matching query, annotated with `search_rank`"""
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(query, config=CONFIG)
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query)
+        )
+    ranked = inverted_index.search(query, settings.RECIPE_SEARCH_LIMIT)
+    return queryset.filter(pk__in=[pk for pk, _ in ranked]).annotate(
+        search_rank=Case(
+            *[When(pk=pk, then=Value(score)) for pk, score in ranked],
+            default=Value(0.0),
+            output_field=FloatField()
+        )
+    )
@@ -0,0 +1,110 @@
+import functools
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps, features
+
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+# recipe field: largest width and height of the rendition
+RENDITIONS = {
+    'image_thumbnail': (160, 160),
+    'image_card': (600, 600),
+}
+UPLOAD_TO = 'renditions'
+
+executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Pool is created on first use, so it is not shared by forked workers"""
+    with executor_lock:
+        return create_executor()
+
+
+@functools.lru_cache(maxsize=None)
+def create_executor():
+    return ThreadPoolExecutor(
+        max_workers=settings.IMAGE_RENDITION_WORKERS,
+        thread_name_prefix='renditions'
+    )
+
+
+def schedule_renditions(recipe_id):
+    """Makes renditions in background once the image is committed"""
+    transaction.on_commit(
+        lambda: get_executor().submit(make_renditions_task, recipe_id)
+    )
+
+
+def make_renditions_task(recipe_id):
+    """Pool threads do not go through request cycle, which closes
+    their database connections"""
+    try:
+        make_renditions(recipe_id)
+    finally:
+        connections.close_all()
+
+
+def encode(image, size):
+    """Resized copy without metadata, WebP if Pillow supports it"""
+    rendition = image.copy()
+    rendition.thumbnail(size, Image.LANCZOS)
+    rendition.info = {}
+    output = io.BytesIO()
+    if features.check('webp'):
+        rendition.save(output, 'WEBP', quality=80, method=4)
+        return output.getvalue(), 'webp'
+    rendition.convert('RGB').save(output, 'JPEG', quality=80,
+                                  optimize=True, progressive=True)
+    return output.getvalue(), 'jpg'
+
+
+def make_renditions(recipe_id):
+    """
+    Saves thumbnail and card renditions of the recipe image.
+    Skipped if the image was replaced meanwhile, the newer upload
+    has its own task. `updated_at` is left as is: until renditions
+    are ready the image itself is served, so recipe ETags stay valid.
+    """
+    try:
+        recipe = Recipe.objects.only(
+            'image', *RENDITIONS
+        ).filter(pk=recipe_id).first()
+        if recipe is None or not recipe.image:
+            return
+        with recipe.image.open('rb') as source:
+            image = ImageOps.exif_transpose(Image.open(source))
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGB')
+            stem = os.path.splitext(os.path.basename(recipe.image.name))[0]
+            names = {}
+            for field, size in RENDITIONS.items():
+                content, extension = encode(image, size)
+                names[field] = default_storage.save(
+                    '{}/{}_{}.{}'.format(UPLOAD_TO, stem,
+                                         field.split('_')[-1], extension),
+                    ContentFile(content)
+                )
+        updated = Recipe.objects.filter(
+            pk=recipe_id, image=recipe.image.name
+        ).update(**names)
+        stale = [
+            getattr(recipe, field).name for field in RENDITIONS
+            if getattr(recipe, field)
+        ]
+        if not updated:
+            stale = list(names.values())
+        for name in stale:
+            default_storage.delete(name)
+    except Exception:
+        logger.exception('Renditions of recipe %s failed', recipe_id)
@@ -0,0 +1,53 @@
+import csv
+
+from django.http import StreamingHttpResponse
+
+from .pdfmaker import pdf_shopping_list_maker
+
+
+class Echo:
+    """File-like object for csv.writer, returns the line instead of storing"""
+    def write(self, value):
+        return value
+
+
+def csv_shopping_list_maker(rows):
+    """Yields csv lines: ingredient, amount, measurement unit"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(['Ингредиент', 'Количество', 'Единица измерения'])
+    for name, amount, measurement_unit in rows:
+        yield writer.writerow([name, amount, measurement_unit])
+
+
+def txt_shopping_list_maker(rows):
+    """Yields plain text lines of shopping list"""
+    yield 'Список покупок Foodgram\n\n'
+    for name, amount, measurement_unit in rows:
+        yield '{} - {} {}\n'.format(name.capitalize(), amount,
+                                    measurement_unit)
+
+
+EXPORT_FORMATS = {
+    'pdf': (pdf_shopping_list_maker, 'application/pdf'),
+    'csv': (csv_shopping_list_maker, 'text/csv; charset=utf-8'),
+    'txt': (txt_shopping_list_maker, 'text/plain; charset=utf-8'),
+}
+
+
+def make_shopping_list(rows, export_format):
+    """
+    Generator of document chunks. Rows are the aggregated list, one per
+    ingredient name and base unit, so its size is bounded by the catalogue.
+    """
+    maker, _ = EXPORT_FORMATS[export_format]
+    return maker(rows)
+
+
+def shopping_list_response(content, export_format):
+    """Streams shopping list document in requested format as attachment"""
+    _, content_type = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = (
+        'attachment; filename="foodgram.{}"'.format(export_format)
+    )
+    return response
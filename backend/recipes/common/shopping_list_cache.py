@@ -0,0 +1,62 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class ShoppingListCache:
+    """
+    Rendered shopping lists, keyed by digest of aggregated
+    (ingredient, amount, measurement unit) rows and export format.
+    Last digest of every user is kept until their cart or recipes
+    in it change, so repeat downloads skip the aggregation query.
+    """
+    user_key = 'shopping_list:user:{}'
+    document_key = 'shopping_list:document:{}'
+
+    def __init__(self):
+        self.cache = caches[settings.SHOPPING_LIST_CACHE]
+
+    def digest(self, user_id, export_format):
+        digests = self.cache.get(self.user_key.format(user_id), {})
+        return digests.get(export_format)
+
+    def remember(self, user_id, export_format, rows):
+        """Calculates digest of rows and saves it as user's last one"""
+        content = hashlib.sha256(export_format.encode())
+        for row in rows:
+            content.update(repr(row).encode())
+        digest = content.hexdigest()
+        key = self.user_key.format(user_id)
+        digests = self.cache.get(key, {})
+        digests[export_format] = digest
+        self.cache.set(key, digests)
+        return digest
+
+    def invalidate(self, user_ids):
+        self.cache.delete_many(
+            [self.user_key.format(user_id) for user_id in user_ids]
+        )
+
+    def document(self, digest):
+        return self.cache.get(self.document_key.format(digest))
+
+    def store(self, digest, chunks):
+        """
+        Passes chunks through and caches the whole document
+        once it is streamed, if it is not larger than the limit.
+        """
+        document = []
+        size = 0
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            if document is not None:
+                document.append(chunk)
+                size += len(chunk)
+                if size > settings.SHOPPING_LIST_CACHE_MAX_SIZE:
+                    document = None
+            yield chunk
+        if document is not None:
+            self.cache.set(self.document_key.format(digest),
+                           b''.join(document))
@@ -0,0 +1,74 @@
+from django.db.models import (Case, CharField, F, IntegerField, Max, Min, Sum,
+                              Value, When)
+
+# measurement unit: (base unit, amount of base units in one unit),
+# units missing here are not converted and summed only with themselves
+UNITS = {
+    'г': ('г', 1),
+    'кг': ('г', 1000),
+    'мл': ('мл', 1),
+    'л': ('мл', 1000),
+    'ч. л.': ('мл', 5),
+    'ст. л.': ('мл', 15),
+    'стакан': ('мл', 250),
+}
+
+# base unit: units to show merged amount in, largest first
+DISPLAY_UNITS = {
+    'г': (('кг', 1000), ('г', 1)),
+    'мл': (('л', 1000), ('мл', 1)),
+}
+
+
+def base_unit(unit_field):
+    """SQL expression of base unit for measurement unit in unit_field"""
+    return Case(
+        *[When(**{unit_field: unit}, then=Value(base))
+          for unit, (base, _) in UNITS.items()],
+        default=F(unit_field),
+        output_field=CharField()
+    )
+
+
+def base_amount(amount_field, unit_field):
+    """SQL expression of amount converted to base unit"""
+    return Case(
+        *[When(**{unit_field: unit}, then=F(amount_field) * factor)
+          for unit, (_, factor) in UNITS.items()],
+        default=F(amount_field),
+        output_field=IntegerField()
+    )
+
+
+def display_amount(amount, unit):
+    """Amount in base unit shown in the largest unit, which fits it"""
+    for display_unit, factor in DISPLAY_UNITS.get(unit, ()):
+        if amount >= factor:
+            value = amount / factor
+            return (int(value) if value.is_integer() else round(value, 3),
+                    display_unit)
+    return amount, unit
+
+
+def summed_by_name(queryset, name_field, amount_field, unit_field):
+    """
+    (name, amount, unit) rows, one per name and base unit, summed in DB.
+    Names met in one unit keep it, others are merged in base unit.
+    Rows are returned as a list: the digest of a shopping list is taken
+    before it is rendered, and there is at most a row per ingredient.
+    """
+    rows = queryset.order_by().values(
+        name=F(name_field),
+        base=base_unit(unit_field)
+    ).annotate(
+        total=Sum(amount_field),
+        base_total=Sum(base_amount(amount_field, unit_field)),
+        first_unit=Min(unit_field),
+        last_unit=Max(unit_field)
+    ).order_by('name', 'base')
+    return [
+        (row['name'], row['total'], row['first_unit'])
+        if row['first_unit'] == row['last_unit']
+        else (row['name'], *display_amount(row['base_total'], row['base']))
+        for row in rows
+    ]
@@ -3,5 +3,8 @@ DETAILS = {
     'amount': {'detail': 'Количество должно быть больше 0'},
     'unique': {'detail': 'Ингредиенты должны быть уникальными'},
     'cooking_time': {'detail': 'Время приготовления должно быть больше 1 мин'},
-    'tags': {'detail': 'Теги должны быть уникальными'}
+    'tags': {'detail': 'Теги должны быть уникальными'},
+    'format': {'detail': 'Доступные форматы списка покупок: pdf, csv, txt'},
+    'coverage': {'detail': ('Укажите id ингредиентов (?ingredients=1,2) '
+                            'и min_coverage от 0 до 1')},
 }
@@ -0,0 +1,12 @@
+from rest_framework import serializers
+
+
+class RenditionField(serializers.ImageField):
+    """URL of recipe image rendition, the original one until it is made"""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        return super().get_attribute(instance) or instance.image
@@ -1,7 +1,14 @@
+from django.db.models import Exists, OuterRef
 from django_filters import (BooleanFilter, CharFilter, FilterSet,
                             ModelMultipleChoiceFilter, NumberFilter)
+from rest_framework.filters import OrderingFilter
 
-from .models import Ingredient, Recipe, Tag
+from .common.recipe_search import search_recipes
+from .models import FavoriteAndShoppingCart, Recipe, Tag
+
+
+def search_param(request):
+    return request.query_params.get('search', '').strip()
 
 
 class RecipeFilter(FilterSet):
@@ -16,31 +23,56 @@ class RecipeFilter(FilterSet):
     )
     is_favorited = BooleanFilter(method='favorite_filter')
     is_in_shopping_cart = BooleanFilter(method='shopping_cart_filter')
+    search = CharFilter(method='search_filter')
 
-    def shopping_cart_filter(self, queryset, name, value):
+    def user_recipes_filter(self, queryset, flag, value):
+        """Exists subquery, served by partial index on (user, recipe)"""
         if self.request.user.is_authenticated and value:
-            return queryset.filter(
-                is_favorited__user=self.request.user,
-                is_favorited__is_in_shopping_cart=value
-            )
+            return queryset.filter(Exists(
+                FavoriteAndShoppingCart.objects.filter(
+                    user=self.request.user,
+                    recipe=OuterRef('pk'),
+                    **{flag: True}
+                )
+            ))
         return queryset
 
+    def shopping_cart_filter(self, queryset, name, value):
+        return self.user_recipes_filter(
+            queryset, 'is_in_shopping_cart', value
+        )
+
     def favorite_filter(self, queryset, name, value):
-        if self.request.user.is_authenticated and value:
-            return queryset.filter(
-                is_favorited__user=self.request.user,
-                is_favorited__is_favorited=value
-            )
-        return queryset
+        return self.user_recipes_filter(queryset, 'is_favorited', value)
+
+    def search_filter(self, queryset, name, value):
+        """Name, ingredients and text search, annotates `search_rank`"""
+        if not search_param(self.request):
+            return queryset
+        return search_recipes(queryset, search_param(self.request))
 
     class Meta:
         model = Recipe
-        fields = ['author', 'tags', 'is_favorited', 'is_in_shopping_cart']
+        fields = ['author', 'tags', 'is_favorited', 'is_in_shopping_cart',
+                  'search']
 
 
-class IngredientFilter(FilterSet):
-    name = CharFilter(lookup_expr='icontains')
+class RecipeOrderingFilter(OrderingFilter):
+    """
+    `?ordering=-favorites_count`, newer recipes first among equal ones,
+    so page number pages stay stable. Cursor pages refuse any ordering
+    but the default one. Search results are ranked first, unless
+    ordering is given.
+    """
+    tie_breakers = ('-pub_date', '-id')
 
-    class Meta:
-        model = Ingredient
-        fields = ['name']
+    def get_ordering(self, request, queryset, view):
+        ordering = list(super().get_ordering(request, queryset, view))
+        if (search_param(request)
+                and not request.query_params.get(self.ordering_param)):
+            ordering.insert(0, '-search_rank')
+        return ordering + [
+            field for field in self.tie_breakers
+            if field.lstrip('-') not in
+            (term.lstrip('-') for term in ordering)
+        ]
@@ -0,0 +1,220 @@
+import base64
+import io
+import json
+import statistics
+import subprocess
+import time
+from typing import Any, Callable, NamedTuple, Optional
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.common.shopping_list_cache import ShoppingListCache
+from recipes.models import (FavoriteAndShoppingCart, Ingredient,
+                            IngredientAmount, Recipe, Tag)
+from users.models import Follow, User
+
+from .seed_data import PREFIX
+
+UPDATED_NAME = 'Benchmark updated recipe'
+
+
+class Case(NamedTuple):
+    name: str
+    method: str
+    path: str
+    data: Optional[Callable[[int], dict]] = None
+    setup: Optional[Callable[[], None]] = None
+
+
+class Command(BaseCommand):
+    help = ('Time API hot paths with the Django test client on the dataset '
+            'made by seed_data and print results as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--output', help='File for JSON results')
+        parser.add_argument('--only', nargs='*', default=[],
+                            help='Names of cases to run')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        recipe = Recipe.objects.filter(
+            name__startswith=PREFIX
+        ).select_related('author').order_by('pk').first()
+        if recipe is None:
+            raise CommandError('No seeded data, run seed_data first')
+        self.user = recipe.author
+        self.recipe = recipe
+        self.created = []
+        self.client = APIClient(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(
+            Token.objects.get_or_create(user=self.user)[0].key
+        ))
+        try:
+            self.updated = self.create_updated()
+            cases = [
+                case for case in self.cases()
+                if not options['only'] or case.name in options['only']
+            ]
+            results = [self.run(case, options['repeat']) for case in cases]
+        finally:
+            for created in Recipe.objects.filter(pk__in=self.created):
+                created.image.delete(save=False)
+                created.delete()
+        report = json.dumps({
+            'commit': self.commit(),
+            'database': connection.vendor,
+            'repeat': options['repeat'],
+            'dataset': {
+                'users': User.objects.count(),
+                'recipes': Recipe.objects.count(),
+                'ingredients': Ingredient.objects.count(),
+                'ingredient_amounts': IngredientAmount.objects.count(),
+                'follows': Follow.objects.count(),
+                'favorites_and_carts':
+                    FavoriteAndShoppingCart.objects.count(),
+            },
+            'results': results,
+        }, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                output.write(report)
+        else:
+            self.stdout.write(report)
+
+    def create_updated(self):
+        """
+        Recipe for recipe_update, deleted with the created ones,
+        so seeded recipes stay the same between runs
+        """
+        response = self.client.post(
+            '/api/recipes/', dict(self.recipe_data(0), name=UPDATED_NAME),
+            format='json'
+        )
+        if response.status_code != 201:
+            raise CommandError(
+                'Recipe to update was not created: {}'.format(response.data)
+            )
+        self.created.append(response.data['id'])
+        return response.data['id']
+
+    def cases(self):
+        recipes = '/api/recipes/'
+        detail = '{}{}/'.format(recipes, self.recipe.pk)
+        updated = '{}{}/'.format(recipes, self.updated)
+        tags = '&'.join(
+            'tags={}'.format(slug)
+            for slug in Tag.objects.values_list('slug', flat=True)[:2]
+        )
+        query = Ingredient.objects.order_by('pk').values_list(
+            'search_name', flat=True
+        ).first()[:3]
+        word = IngredientAmount.objects.filter(
+            recipe__name__startswith=PREFIX
+        ).order_by('pk').values_list('ingredient__name', flat=True).first()
+        cart = '{}download_shopping_cart/?format={{}}'.format(recipes)
+        cases = [
+            Case('recipes_list', 'get', recipes),
+            Case('recipes_list_tags', 'get', '{}?{}'.format(recipes, tags)),
+            Case('recipes_list_author', 'get',
+                 '{}?author={}'.format(recipes, self.user.pk)),
+            Case('recipes_list_favorited', 'get',
+                 '{}?is_favorited=1'.format(recipes)),
+            Case('recipes_list_in_shopping_cart', 'get',
+                 '{}?is_in_shopping_cart=1'.format(recipes)),
+            Case('recipes_list_popular', 'get',
+                 '{}?ordering=-favorites_count'.format(recipes)),
+            Case('recipes_list_cursor', 'get', '{}?cursor='.format(recipes)),
+            Case('recipes_search', 'get', '{}?{}'.format(
+                recipes, urlencode({'search': (word or 'recipe').split()[0]})
+            )),
+            Case('recipe_detail', 'get', detail),
+            Case('recipe_create', 'post', recipes, data=self.recipe_data),
+            Case('recipe_update', 'patch', updated, data=self.update_data),
+            Case('users_subscriptions', 'get', '/api/users/subscriptions/'),
+            Case('ingredients_search', 'get',
+                 '/api/ingredients/?name={}'.format(query)),
+        ]
+        for export_format in ('pdf', 'csv', 'txt'):
+            cases.append(Case(
+                'download_shopping_cart_{}'.format(export_format), 'get',
+                cart.format(export_format),
+                setup=self.clear_shopping_lists
+            ))
+        return cases
+
+    def clear_shopping_lists(self):
+        """Every download aggregates and renders the list again"""
+        ShoppingListCache().cache.clear()
+
+    def run(self, case, repeat):
+        """First request warms up caches, it is not counted"""
+        timings = []
+        for number in range(repeat + 1):
+            if case.setup:
+                case.setup()
+            data = case.data(number) if case.data else None
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = getattr(self.client, case.method)(
+                    case.path, data, format='json'
+                )
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                elapsed = time.perf_counter() - start
+            if case.method == 'post' and response.status_code == 201:
+                self.created.append(response.data['id'])
+            if number:
+                timings.append(elapsed * 1000)
+        return {
+            'name': case.name,
+            'method': case.method.upper(),
+            'path': case.path,
+            'status': response.status_code,
+            'queries': len(queries),
+            'min_ms': round(min(timings), 2),
+            'median_ms': round(statistics.median(timings), 2),
+            'max_ms': round(max(timings), 2),
+        }
+
+    def recipe_data(self, number):
+        image = io.BytesIO()
+        Image.new('RGB', (64, 64), '#49B64E').save(image, 'PNG')
+        return dict(
+            self.update_data(number),
+            name='Benchmark recipe {}'.format(number),
+            image='data:image/png;base64,{}'.format(
+                base64.b64encode(image.getvalue()).decode()
+            )
+        )
+
+    def update_data(self, number):
+        """Every other run changes amounts of the same ingredients"""
+        ingredients = Ingredient.objects.order_by('pk').values_list(
+            'pk', flat=True
+        )[:10]
+        return {
+            'ingredients': [
+                {'id': pk, 'amount': 100 + number % 2}
+                for pk in ingredients
+            ],
+            'tags': list(Tag.objects.values_list('pk', flat=True)[:2]),
+            'name': UPDATED_NAME,
+            'text': 'Benchmark',
+            'cooking_time': 30,
+        }
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
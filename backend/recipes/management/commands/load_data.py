@@ -1,20 +1,200 @@
 import csv
-from typing import Any, Optional
+import io
+import json
+import re
+from itertools import islice
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
+from recipes.common.catalogue_cache import ingredients_catalogue
 from recipes.models import Ingredient
 
+DEFAULT_PATH = settings.BASE_DIR / 'recipes' / 'data' / 'ingredients.csv'
+NAME_LENGTH = Ingredient._meta.get_field('name').max_length
+UNIT_LENGTH = Ingredient._meta.get_field('measurement_unit').max_length
+
+WHITESPACE = re.compile(r'\s*')
+
+Row = Tuple[str, str]
+
+
+class JSONArrayReader:
+    """
+    Items of top level JSON array, decoded one by one while the file
+    is read in blocks, so the whole file is never kept in memory
+    """
+    block_size = 64 * 1024
+
+    def __init__(self, data):
+        self.data = data
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+
+    def read_more(self):
+        block = self.data.read(self.block_size)
+        if not block:
+            raise CommandError('Invalid or truncated JSON array')
+        self.buffer = self.buffer[self.position:] + block
+        self.position = 0
+
+    def next_char(self):
+        """Skips whitespace and returns the next character"""
+        while True:
+            self.position = WHITESPACE.match(
+                self.buffer, self.position
+            ).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            self.read_more()
+
+    def decode(self):
+        """Item is decoded again with the next block, if it may go on"""
+        while True:
+            try:
+                item, end = self.decoder.raw_decode(
+                    self.buffer, self.position
+                )
+            except json.JSONDecodeError:
+                self.read_more()
+                continue
+            if end < len(self.buffer):
+                self.position = end
+                return item
+            self.read_more()
+
+    def __iter__(self):
+        if self.next_char() != '[':
+            raise CommandError('JSON file must contain an array')
+        self.position += 1
+        while self.next_char() != ']':
+            yield self.decode()
+            separator = self.next_char()
+            if separator == ',':
+                self.position += 1
+            elif separator != ']':
+                raise CommandError('Invalid JSON array')
+
 
 class Command(BaseCommand):
-    help = 'Load ingredients from data/ to DB'
-
-    def handle(self, *args: Any, **options: Any) -> Optional[str]:
-        with open('recipes/data/ingredients.csv', encoding='utf-8') as data:
-            reader = csv.reader(data)
-            for row in reader:
-                name, measurement_unit = row
-                Ingredient.objects.get_or_create(
-                    name=name,
-                    measurement_unit=measurement_unit
+    help = ('Load ingredients from csv (name,measurement_unit) or json '
+            '([{"name": ..., "measurement_unit": ...}]) file to DB')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=str(DEFAULT_PATH))
+        parser.add_argument(
+            '--format', choices=['csv', 'json'],
+            help='File format, by default taken from file extension'
+        )
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Read and validate the file without writing to DB'
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        path = options['path']
+        data_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if data_format not in ('csv', 'json'):
+            raise CommandError('Unknown file format: {}'.format(path))
+        insert = self.bulk_create
+        if connection.vendor == 'postgresql':
+            insert = self.copy
+        before = Ingredient.objects.count()
+        seen = set()
+        read = skipped = 0
+        with open(path, encoding='utf-8') as data:
+            rows = self.read_rows(data, data_format)
+            while True:
+                chunk = list(islice(rows, options['chunk_size']))
+                if not chunk:
+                    break
+                read += len(chunk)
+                new_rows = []
+                for row in chunk:
+                    if row is None:
+                        skipped += 1
+                    elif row not in seen:
+                        seen.add(row)
+                        new_rows.append(row)
+                if not options['dry_run']:
+                    insert(new_rows)
+                self.stdout.write(
+                    'Read {} rows, {} unique, {} skipped'.format(
+                        read, len(seen), skipped
+                    )
+                )
+        if not options['dry_run']:
+            ingredients_catalogue.bump()
+            self.stdout.write(self.style.SUCCESS(
+                'Created {} ingredients'.format(
+                    Ingredient.objects.count() - before
+                )
+            ))
+
+    def read_rows(self, data, data_format) -> Iterator[Optional[Row]]:
+        """
+        Yields valid (name, measurement_unit) rows and None for invalid.
+        Measurement unit may be empty, the bundled file has such rows.
+        """
+        if data_format == 'json':
+            records: Iterable[Any] = (
+                (item.get('name'), item.get('measurement_unit', ''))
+                if isinstance(item, dict) else ()
+                for item in JSONArrayReader(data)
+            )
+        else:
+            records = csv.reader(data)
+        for record in records:
+            if (len(record) != 2
+                    or not all(isinstance(value, str) for value in record)):
+                yield None
+                continue
+            name, measurement_unit = (value.strip() for value in record)
+            if (not name or len(name) > NAME_LENGTH
+                    or len(measurement_unit) > UNIT_LENGTH):
+                yield None
+                continue
+            yield name, measurement_unit
+
+    def bulk_create(self, rows: List[Row]) -> None:
+        Ingredient.objects.bulk_create(
+            [
+                Ingredient(name=name, measurement_unit=measurement_unit,
+                           search_name=name.lower())
+                for name, measurement_unit in rows
+            ],
+            ignore_conflicts=True
+        )
+
+    def copy(self, rows: List[Row]) -> None:
+        """COPY rows to temporary table and insert new ones from it"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for name, measurement_unit in rows:
+            writer.writerow([name, measurement_unit, name.lower()])
+        buffer.seek(0)
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE ingredient_import '
+                '(name varchar({0}), measurement_unit varchar({1}), '
+                'search_name varchar({0})) ON COMMIT DROP'.format(
+                    NAME_LENGTH, UNIT_LENGTH
                 )
+            )
+            # empty measurement unit is written as empty field,
+            # which COPY reads as NULL unless told otherwise
+            cursor.copy_expert(
+                'COPY ingredient_import FROM STDIN '
+                'WITH (FORMAT csv, FORCE_NOT_NULL (measurement_unit))',
+                buffer
+            )
+            cursor.execute(
+                'INSERT INTO {} (name, measurement_unit, search_name) '
+                'SELECT name, measurement_unit, search_name '
+                'FROM ingredient_import ON CONFLICT DO NOTHING'.format(table)
+            )
@@ -0,0 +1,26 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from recipes.common.renditions import RENDITIONS, make_renditions
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Make missing thumbnail and card renditions of recipe images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Remake renditions of every recipe')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(**{field: '' for field in RENDITIONS})
+        made = 0
+        for pk in recipes.values_list('pk', flat=True).iterator():
+            make_renditions(pk)
+            made += 1
+        self.stdout.write(self.style.SUCCESS(
+            'Processed images of {} recipes'.format(made)
+        ))
@@ -0,0 +1,43 @@
+from itertools import islice
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import FeedItem
+from users.models import Follow
+
+
+class Command(BaseCommand):
+    help = ('Rebuild precomputed feeds of users following at least '
+            'FEED_FANOUT_MIN_FOLLOWS authors, e.g. after changing it or '
+            'editing follows in admin')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100,
+                            help='Users rebuilt in one transaction')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        if not settings.FEED_FANOUT_MIN_FOLLOWS:
+            FeedItem.objects.all().delete()
+            self.stdout.write('Precomputed feeds are turned off')
+            return
+        fanout_users = FeedItem.objects.fanout_users(
+            Follow.objects.values('user')
+        )
+        FeedItem.objects.exclude(user__in=fanout_users).delete()
+        user_ids = fanout_users.order_by('user').values_list(
+            'user', flat=True
+        ).iterator()
+        rebuilt = 0
+        while True:
+            chunk = list(islice(user_ids, options['chunk_size']))
+            if not chunk:
+                break
+            with transaction.atomic():
+                FeedItem.objects.refresh(chunk)
+            rebuilt += len(chunk)
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt feeds of {} users'.format(rebuilt)
+        ))
@@ -0,0 +1,38 @@
+from itertools import islice
+from typing import Any
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.common.shopping_list_cache import ShoppingListCache
+from recipes.models import FavoriteAndShoppingCart, ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = ('Rebuild precomputed shopping lists from shopping carts, '
+            'e.g. after bulk deletes of recipe ingredients')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Users rebuilt in one transaction')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        holders = FavoriteAndShoppingCart.objects.filter(
+            is_in_shopping_cart=True
+        ).values('user_id')
+        ShoppingListItem.objects.exclude(user__in=holders).delete()
+        user_ids = holders.order_by('user_id').distinct().values_list(
+            'user_id', flat=True
+        ).iterator()
+        rebuilt = 0
+        while True:
+            chunk = list(islice(user_ids, options['chunk_size']))
+            if not chunk:
+                break
+            with transaction.atomic():
+                ShoppingListItem.objects.refresh(chunk)
+            ShoppingListCache().invalidate(chunk)
+            rebuilt += len(chunk)
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt shopping lists of {} users'.format(rebuilt)
+        ))
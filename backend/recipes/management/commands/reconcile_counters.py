@@ -0,0 +1,49 @@
+from itertools import islice
+from typing import Any
+
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from recipes.models import FavoriteAndShoppingCart, Recipe
+
+
+class Command(BaseCommand):
+    help = ('Recalculate favorites_count and cart_count of recipes '
+            'which drifted from favorite and shopping cart rows, '
+            'meant to be run periodically (cron)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report recipes with wrong counters'
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        counters = {
+            counter: FavoriteAndShoppingCart.objects.count_subquery(flag)
+            for flag, counter in (
+                FavoriteAndShoppingCart.objects.counters.items()
+            )
+        }
+        drifted = Recipe.objects.annotate(
+            **{'actual_' + counter: value
+               for counter, value in counters.items()}
+        ).exclude(
+            **{counter: F('actual_' + counter) for counter in counters}
+        ).order_by().values_list('pk', flat=True).iterator()
+        fixed = 0
+        while True:
+            chunk = list(islice(drifted, options['chunk_size']))
+            if not chunk:
+                break
+            fixed += len(chunk)
+            if not options['dry_run']:
+                # counted again in UPDATE, toggles made since the select
+                # are not overwritten with stale numbers
+                Recipe.objects.filter(pk__in=chunk).update(**counters)
+        self.stdout.write(self.style.SUCCESS(
+            '{} {} recipes'.format(
+                'Found' if options['dry_run'] else 'Reconciled', fixed
+            )
+        ))
@@ -0,0 +1,167 @@
+import io
+import random
+from typing import Any
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from recipes.common.recipe_search import index_recipes
+from recipes.models import (FavoriteAndShoppingCart, Ingredient,
+                            IngredientAmount, Recipe, Tag)
+from users.models import Follow, User
+
+PREFIX = 'seed_'
+PASSWORD = 'seed-password'
+IMAGE = PREFIX + 'recipe.png'
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Seed reproducible synthetic dataset for benchmarks: users, '
+            'recipes, follows, favorites and shopping carts. Users are '
+            'named seed_<n> with password "{}"'.format(PASSWORD))
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--follows', type=int, default=10,
+                            help='Follows per user')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Favorite recipes per user')
+        parser.add_argument('--carts', type=int, default=5,
+                            help='Recipes in shopping cart per user')
+        parser.add_argument('--seed', type=int, default=42,
+                            help='Random seed, same seed gives same data')
+        parser.add_argument(
+            '--flush', action='store_true',
+            help='Delete previously seeded users with their recipes first'
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        seeded = User.objects.filter(username__startswith=PREFIX)
+        if options['flush']:
+            seeded.delete()
+        elif seeded.exists():
+            raise CommandError('Dataset is already seeded, use --flush')
+        if options['users'] < 1:
+            raise CommandError('At least one user is needed')
+        if not Ingredient.objects.exists():
+            call_command('load_data', stdout=self.stdout)
+        self.random = random.Random(options['seed'])
+        with transaction.atomic():
+            users = self.create_users(options['users'])
+            recipes = self.create_recipes(users, options['recipes'])
+            self.create_follows(users, options['follows'])
+            self.create_user_recipes(users, recipes, options)
+            index_recipes([recipe.pk for recipe in recipes])
+        # rows are bulk created, signals keeping these in sync do not fire
+        call_command('reconcile_counters', stdout=self.stdout)
+        call_command('rebuild_shopping_lists', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            'Seeded {} users and {} recipes'.format(len(users), len(recipes))
+        ))
+
+    def create_users(self, count):
+        password = make_password(PASSWORD)
+        User.objects.bulk_create(
+            User(
+                username='{}{}'.format(PREFIX, number),
+                email='{}{}@example.com'.format(PREFIX, number),
+                first_name='Seed',
+                last_name='User {}'.format(number),
+                password=password,
+            )
+            for number in range(count)
+        )
+        # pk is not set by bulk_create on SQLite
+        return list(User.objects.filter(
+            username__startswith=PREFIX
+        ).order_by('pk'))
+
+    def create_recipes(self, users, count):
+        if not default_storage.exists(IMAGE):
+            image = io.BytesIO()
+            Image.new('RGB', (64, 64), '#E26C2D').save(image, 'PNG')
+            default_storage.save(IMAGE, ContentFile(image.getvalue()))
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=self.random.choice(users),
+                name='{}recipe {}'.format(PREFIX, number),
+                image=IMAGE,
+                text='Synthetic recipe {}'.format(number),
+                cooking_time=self.random.randint(1, 180),
+            )
+            for number in range(count)
+        )
+        recipes = list(Recipe.objects.filter(
+            name__startswith=PREFIX
+        ).order_by('pk'))
+        ingredient_ids = list(
+            Ingredient.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        tags = [
+            Tag.objects.get_or_create(
+                slug=slug, defaults={'name': name, 'color': color}
+            )[0]
+            for name, color, slug in TAGS
+        ]
+        amounts = []
+        recipe_tags = []
+        for recipe in recipes:
+            for ingredient_id in self.random.sample(
+                ingredient_ids, min(len(ingredient_ids),
+                                    self.random.randint(3, 10))
+            ):
+                amounts.append(IngredientAmount(
+                    recipe=recipe,
+                    ingredient_id=ingredient_id,
+                    amount=self.random.randint(1, 500)
+                ))
+            for tag in self.random.sample(tags, self.random.randint(1, 2)):
+                recipe_tags.append(Recipe.tags.through(
+                    recipe_id=recipe.pk, tag_id=tag.pk
+                ))
+        IngredientAmount.objects.bulk_create(amounts)
+        Recipe.tags.through.objects.bulk_create(recipe_tags)
+        return recipes
+
+    def create_follows(self, users, count):
+        follows = []
+        for user in users:
+            candidates = self.random.sample(
+                users, min(count + 1, len(users))
+            )
+            follows.extend(
+                Follow(user=user, following=following)
+                for following in [
+                    other for other in candidates if other.pk != user.pk
+                ][:count]
+            )
+        Follow.objects.bulk_create(follows)
+
+    def create_user_recipes(self, users, recipes, options):
+        rows = []
+        for user in users:
+            favorites = set(self.random.sample(
+                recipes, min(options['favorites'], len(recipes))
+            ))
+            carts = set(self.random.sample(
+                recipes, min(options['carts'], len(recipes))
+            ))
+            for recipe in sorted(favorites | carts, key=lambda r: r.pk):
+                rows.append(FavoriteAndShoppingCart(
+                    user=user,
+                    recipe=recipe,
+                    is_favorited=recipe in favorites,
+                    is_in_shopping_cart=recipe in carts
+                ))
+        FavoriteAndShoppingCart.objects.bulk_create(rows)
@@ -0,0 +1,48 @@
+# Generated by Django 3.0.5 on 2026-10-18 12:30
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Points amounts of duplicates to the first ingredient and drops them"""
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientAmount = apps.get_model('recipes', 'IngredientAmount')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(first_id=Min('id'), total=Count('id')).filter(total__gt=1)
+    for group in duplicates:
+        copies = Ingredient.objects.filter(
+            name=group['name'],
+            measurement_unit=group['measurement_unit']
+        ).exclude(id=group['first_id'])
+        for amount in IngredientAmount.objects.filter(ingredient__in=copies):
+            kept = IngredientAmount.objects.filter(
+                recipe_id=amount.recipe_id,
+                ingredient_id=group['first_id']
+            ).first()
+            if kept is None:
+                amount.ingredient_id = group['first_id']
+                amount.save()
+            else:
+                kept.amount += amount.amount
+                kept.save()
+                amount.delete()
+        copies.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_ingredient_search_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient_unit'),
+        ),
+    ]
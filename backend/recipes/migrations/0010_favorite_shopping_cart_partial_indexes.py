@@ -0,0 +1,37 @@
+# Generated by Django 3.0.5 on 2026-10-18 13:30
+
+from django.db import migrations, models
+
+
+def delete_empty_rows(apps, schema_editor):
+    """Rows with neither flag left by the old delete path mean nothing"""
+    FavoriteAndShoppingCart = apps.get_model(
+        'recipes', 'FavoriteAndShoppingCart'
+    )
+    FavoriteAndShoppingCart.objects.filter(
+        is_favorited=False,
+        is_in_shopping_cart=False
+    ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='favoriteandshoppingcart',
+            options={'verbose_name': 'Избранное и корзина', 'verbose_name_plural': 'Избранное и корзины'},
+        ),
+        migrations.RunPython(delete_empty_rows, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='favoriteandshoppingcart',
+            index=models.Index(condition=models.Q(is_favorited=True), fields=['user', 'recipe'], name='favorite_user_recipe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='favoriteandshoppingcart',
+            index=models.Index(condition=models.Q(is_in_shopping_cart=True), fields=['user', 'recipe'], name='shopping_cart_user_recipe_idx'),
+        ),
+    ]
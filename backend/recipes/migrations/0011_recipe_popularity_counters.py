@@ -0,0 +1,52 @@
+# Generated by Django 3.0.5 on 2026-10-18 14:00
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    FavoriteAndShoppingCart = apps.get_model(
+        'recipes', 'FavoriteAndShoppingCart'
+    )
+    Recipe = apps.get_model('recipes', 'Recipe')
+
+    def count(flag):
+        users = FavoriteAndShoppingCart.objects.filter(
+            recipe=OuterRef('pk'), **{flag: True}
+        )
+        return Coalesce(Subquery(
+            users.order_by().values('recipe').annotate(
+                total=Count('pk')
+            ).values('total')
+        ), 0)
+
+    Recipe.objects.update(
+        favorites_count=count('is_favorited'),
+        cart_count=count('is_in_shopping_cart')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_favorite_shopping_cart_partial_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлено в корзину (раз)'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлено в избранное (раз)'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-pub_date'], name='recipe_favorites_count_idx'),
+        ),
+    ]
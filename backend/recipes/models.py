@@ -1,11 +1,162 @@
 from colorfield.fields import ColorField
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from users.models import Follow
 
 User = get_user_model()
 
 
+class FavoriteAndShoppingCartManager(models.Manager):
+    """
+    Single statement toggles of favorite and shopping cart flags,
+    safe for concurrent requests without explicit row locks.
+    Both return (is_favorited, is_in_shopping_cart) state of the row
+    after the change or None if there was nothing to change.
+    Batch versions return ids of recipes, which were changed.
+    """
+    flags = ('is_favorited', 'is_in_shopping_cart')
+    counters = {
+        'is_favorited': 'favorites_count',
+        'is_in_shopping_cart': 'cart_count',
+    }
+
+    def execute(self, sql, flag, params, fetch='fetchone'):
+        if flag not in self.flags:
+            raise ValueError('Unknown flag: {}'.format(flag))
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        other, = (name for name in self.flags if name != flag)
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(
+                table=quote(self.model._meta.db_table),
+                recipe_table=quote(
+                    self.model._meta.get_field('recipe').related_model
+                    ._meta.db_table
+                ),
+                flag=quote(flag),
+                other=quote(other),
+                counter=quote(self.counters[flag]),
+                returning='{}, {}'.format(*map(quote, self.flags)),
+            ), params)
+            return getattr(cursor, fetch)()
+
+    def add_flag(self, user_id, recipe_id, flag):
+        """
+        Creates row with the flag or sets it, if it is not set yet.
+        Nothing is inserted for a missing recipe, so no lookup is needed
+        before it.
+        """
+        row = self.execute(
+            'INSERT INTO {table} (user_id, recipe_id, {flag}, {other}) '
+            'SELECT %s, id, %s, %s FROM {recipe_table} WHERE id = %s '
+            'ON CONFLICT (user_id, recipe_id) DO UPDATE SET {flag} = %s '
+            'WHERE {table}.{flag} = %s RETURNING {returning}',
+            flag, [user_id, True, False, recipe_id, True, False]
+        )
+        return row and tuple(map(bool, row))
+
+    def remove_flag(self, user_id, recipe_id, flag):
+        """
+        Deletes row if no other flag is left, otherwise clears flag.
+        A concurrent removal of the other flag may clear it in between:
+        UPDATE waits for its row lock and sees both flags cleared,
+        then the empty row is deleted.
+        """
+        params = [user_id, recipe_id, True]
+        if self.execute(
+            'DELETE FROM {table} WHERE user_id = %s AND recipe_id = %s '
+            'AND {flag} = %s AND {other} = %s RETURNING {returning}',
+            flag, params + [False]
+        ):
+            return False, False
+        row = self.execute(
+            'UPDATE {table} SET {flag} = %s '
+            'WHERE user_id = %s AND recipe_id = %s AND {flag} = %s '
+            'RETURNING {returning}',
+            flag, [False] + params
+        )
+        if row and not any(row):
+            self.delete_empty(user_id, [recipe_id], flag)
+        return row and tuple(map(bool, row))
+
+    def delete_empty(self, user_id, recipe_ids, flag):
+        """Deletes rows of the user with no flags left"""
+        self.execute(
+            'DELETE FROM {table} WHERE {flag} = %s AND {other} = %s '
+            'AND user_id = %s AND recipe_id IN ('
+            + ', '.join(['%s'] * len(recipe_ids)) + ') RETURNING id',
+            flag, [False, False, user_id, *recipe_ids], fetch='fetchall'
+        )
+
+    def change_counter(self, recipe_ids, flag, delta, fields=('id',)):
+        """
+        Adds delta to the popularity counter of the flag, not going
+        below 0, and returns the recipes with only `fields` loaded
+        """
+        recipe_model = self.model._meta.get_field('recipe').related_model
+        fields = [
+            field.attname for field in recipe_model._meta.concrete_fields
+            if field.attname in fields
+        ]
+        quote = connections[self.db].ops.quote_name
+        rows = self.execute(
+            'UPDATE {recipe_table} SET {counter} = CASE '
+            'WHEN {counter} + %s < 0 THEN 0 ELSE {counter} + %s END '
+            'WHERE id IN (' + ', '.join(['%s'] * len(recipe_ids)) + ') '
+            'RETURNING ' + ', '.join(map(quote, fields)),
+            flag, [delta, delta, *recipe_ids], fetch='fetchall'
+        )
+        return [recipe_model.from_db(self.db, fields, row) for row in rows]
+
+    def add_flags(self, user_id, recipe_ids, flag):
+        """Batch add_flag, returns set of recipe ids, which got the flag"""
+        values = []
+        for recipe_id in recipe_ids:
+            values.extend([user_id, recipe_id, True, False])
+        rows = self.execute(
+            'INSERT INTO {table} (user_id, recipe_id, {flag}, {other}) '
+            'VALUES ' + ', '.join(['(%s, %s, %s, %s)'] * len(recipe_ids))
+            + ' ON CONFLICT (user_id, recipe_id) DO UPDATE SET {flag} = %s '
+            'WHERE {table}.{flag} = %s RETURNING recipe_id',
+            flag, values + [True, False], fetch='fetchall'
+        )
+        return {recipe_id for recipe_id, in rows}
+
+    def remove_flags(self, user_id, recipe_ids, flag):
+        """Batch remove_flag, returns set of recipe ids, which lost the flag"""
+        rows = ('user_id = %s AND recipe_id IN ('
+                + ', '.join(['%s'] * len(recipe_ids)) + ')')
+        deleted = self.execute(
+            'DELETE FROM {table} WHERE {flag} = %s AND {other} = %s AND '
+            + rows + ' RETURNING recipe_id',
+            flag, [True, False, user_id, *recipe_ids], fetch='fetchall'
+        )
+        updated = self.execute(
+            'UPDATE {table} SET {flag} = %s WHERE {flag} = %s AND '
+            + rows + ' RETURNING recipe_id, {other}',
+            flag, [False, True, user_id, *recipe_ids], fetch='fetchall'
+        )
+        emptied = [recipe_id for recipe_id, other in updated if not other]
+        if emptied:
+            self.delete_empty(user_id, emptied, flag)
+        return {recipe_id for recipe_id, *_ in deleted + updated}
+
+    def count_subquery(self, flag):
+        """Number of users with the flag set for OuterRef('pk') recipe"""
+        users = self.filter(recipe=OuterRef('pk'), **{flag: True})
+        return Coalesce(Subquery(
+            users.order_by().values('recipe').annotate(
+                total=Count('pk')
+            ).values('total')
+        ), 0)
+
+
 class FavoriteAndShoppingCart(models.Model):
     recipe = models.ForeignKey(
         'Recipe',
@@ -28,6 +179,8 @@ class FavoriteAndShoppingCart(models.Model):
         verbose_name='В корзине'
     )
 
+    objects = FavoriteAndShoppingCartManager()
+
     def __str__(self):
         return f'{self.user.username} {self.recipe.name}'
 
@@ -38,11 +191,28 @@ class FavoriteAndShoppingCart(models.Model):
                 name='unique_favorite_recipe',
             )
         ]
-        ordering = ['-is_in_shopping_cart', '-is_favorited', 'user']
+        indexes = [
+            models.Index(
+                fields=['user', 'recipe'],
+                condition=models.Q(is_favorited=True),
+                name='favorite_user_recipe_idx'
+            ),
+            models.Index(
+                fields=['user', 'recipe'],
+                condition=models.Q(is_in_shopping_cart=True),
+                name='shopping_cart_user_recipe_idx'
+            ),
+        ]
         verbose_name = 'Избранное и корзина'
         verbose_name_plural = 'Избранное и корзины'
 
 
+class RecipeManager(models.Manager):
+    def get_queryset(self):
+        """Search vector is used in SQL only, it is not loaded"""
+        return super().get_queryset().defer('search_vector')
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -58,6 +228,18 @@ class Recipe(models.Model):
     image = models.ImageField(
         verbose_name='Изображение блюда',
     )
+    image_thumbnail = models.ImageField(
+        verbose_name='Миниатюра',
+        upload_to='renditions/',
+        blank=True,
+        editable=False
+    )
+    image_card = models.ImageField(
+        verbose_name='Изображение для карточки',
+        upload_to='renditions/',
+        blank=True,
+        editable=False
+    )
     text = models.TextField(verbose_name='Описание рецепта')
     tags = models.ManyToManyField(
         'Tag',
@@ -68,10 +250,28 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True
     )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True
+    )
     cooking_time = models.SmallIntegerField(
         verbose_name='Время приготовления',
         validators=[MinValueValidator(1)]
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Добавлено в избранное (раз)',
+        default=0,
+        editable=False
+    )
+    cart_count = models.PositiveIntegerField(
+        verbose_name='Добавлено в корзину (раз)',
+        default=0,
+        editable=False
+    )
+    # name, ingredient names and text, GIN index exists on PostgreSQL only
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = RecipeManager()
 
     class Meta:
         constraints = [
@@ -83,6 +283,20 @@ class Recipe(models.Model):
                 name='restrict_double_recipe_author',
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['pub_date', 'id'],
+                name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['-favorites_count', '-pub_date'],
+                name='recipe_favorites_count_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx'
+            ),
+        ]
         ordering = ['-pub_date']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
@@ -118,8 +332,20 @@ class Ingredient(models.Model):
         verbose_name='Единица измерения',
         max_length=16
     )
+    search_name = models.CharField(
+        verbose_name='Название для поиска',
+        max_length=200,
+        db_index=True,
+        editable=False
+    )
 
     class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient_unit',
+            )
+        ]
         ordering = ['id']
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
@@ -127,6 +353,10 @@ class Ingredient(models.Model):
     def __str__(self):
         return '{}, {}'.format(self.name, self.measurement_unit)
 
+    def save(self, *args, **kwargs):
+        self.search_name = self.name.lower()
+        super().save(*args, **kwargs)
+
 
 class IngredientAmount(models.Model):
     ingredient = models.ForeignKey(
@@ -155,3 +385,179 @@ class IngredientAmount(models.Model):
         ]
         verbose_name = 'Количество ингредиента'
         verbose_name_plural = 'Количество ингредиентов'
+
+
+class ShoppingListItemManager(models.Manager):
+    def refresh(self, users, ingredients=None):
+        """
+        Recalculates items of the users for the ingredients (all when None)
+        from recipes in their shopping carts, with one DELETE and one
+        INSERT ... SELECT. `users` and `ingredients` are ids or querysets
+        of ids.
+        """
+        items = self.filter(user__in=users)
+        amounts = IngredientAmount.objects.filter(
+            recipe__is_favorited__user__in=users,
+            recipe__is_favorited__is_in_shopping_cart=True
+        )
+        if ingredients is not None:
+            items = items.filter(ingredient__in=ingredients)
+            amounts = amounts.filter(ingredient__in=ingredients)
+        items.delete()
+        sql, params = amounts.order_by().values(
+            'recipe__is_favorited__user', 'ingredient'
+        ).annotate(total=Sum('amount')).query.sql_with_params()
+        connection = connections[self.db]
+        with connection.cursor() as cursor:
+            # a concurrent refresh may have inserted the same items
+            cursor.execute(
+                'INSERT INTO {table} (user_id, ingredient_id, amount) {sql} '
+                'ON CONFLICT (user_id, ingredient_id) '
+                'DO UPDATE SET amount = excluded.amount'.format(
+                    table=connection.ops.quote_name(self.model._meta.db_table),
+                    sql=sql
+                ),
+                params
+            )
+
+
+class ShoppingListItem(models.Model):
+    """Ingredients of recipes in user's shopping cart, summed"""
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        related_name='shopping_list'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items'
+    )
+    amount = models.PositiveIntegerField(verbose_name='Количество')
+
+    objects = ShoppingListItemManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item',
+            )
+        ]
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Списки покупок'
+
+
+class FeedItemManager(models.Manager):
+    """
+    Precomputed feeds of users following at least FEED_FANOUT_MIN_FOLLOWS
+    authors (0 turns them off). Their feed is read from the user's index
+    instead of joining recipes of all followed authors.
+    """
+
+    def is_precomputed(self, user_id):
+        threshold = settings.FEED_FANOUT_MIN_FOLLOWS
+        return bool(threshold) and Follow.objects.filter(
+            user=user_id
+        ).count() >= threshold
+
+    def fanout_users(self, users):
+        """Ids of users, whose feeds are precomputed"""
+        return Follow.objects.filter(user__in=users).order_by().values(
+            'user'
+        ).annotate(total=Count('pk')).filter(
+            total__gte=settings.FEED_FANOUT_MIN_FOLLOWS
+        ).values('user')
+
+    def refresh(self, users, recipes=None):
+        """
+        Recalculates items of the users for the recipes (all when None)
+        from their follows, with one DELETE and one INSERT ... SELECT.
+        `users` and `recipes` are ids or querysets of ids.
+        """
+        items = self.filter(user__in=users)
+        followed = Recipe.objects.filter(author__followings__user__in=users)
+        if recipes is not None:
+            items = items.filter(recipe__in=recipes)
+            followed = followed.filter(pk__in=recipes)
+        items.delete()
+        sql, params = followed.order_by().values(
+            'author__followings__user', 'pk', 'pub_date'
+        ).query.sql_with_params()
+        connection = connections[self.db]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {table} (user_id, recipe_id, pub_date) {sql} '
+                'ON CONFLICT (user_id, recipe_id) DO NOTHING'.format(
+                    table=connection.ops.quote_name(self.model._meta.db_table),
+                    sql=sql
+                ),
+                params
+            )
+
+    def published(self, recipe):
+        """Fan-out of new recipe to followers with precomputed feeds"""
+        if settings.FEED_FANOUT_MIN_FOLLOWS:
+            self.refresh(
+                self.fanout_users(
+                    Follow.objects.filter(
+                        following=recipe.author_id
+                    ).values('user')
+                ),
+                [recipe.pk]
+            )
+
+    def follows_changed(self, user_id, authors):
+        """
+        Keeps feed of the user in line with follows of the authors.
+        Feed is filled as a whole once the user has enough follows
+        and dropped when they have not.
+        """
+        if not settings.FEED_FANOUT_MIN_FOLLOWS:
+            return
+        if not self.is_precomputed(user_id):
+            self.filter(user=user_id).delete()
+        elif self.filter(user=user_id).exists():
+            self.refresh(
+                [user_id],
+                Recipe.objects.filter(author__in=authors).values('pk')
+            )
+        else:
+            self.refresh([user_id])
+
+
+class FeedItem(models.Model):
+    """Recipe of followed author in user's feed"""
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        related_name='feed'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name='Рецепт',
+        on_delete=models.CASCADE,
+        related_name='feed_items'
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    objects = FeedItemManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_item',
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_item_user_pub_date_idx'
+            ),
+        ]
+        verbose_name = 'Рецепт в ленте'
+        verbose_name_plural = 'Ленты подписок'
@@ -1,10 +1,16 @@
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
+from django.db.models import prefetch_related_objects
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
-from users.serializers import UserSerializer
+from users.serializers import SubscriptionsListSerializer, UserSerializer
+
+from .common.recipe_search import index_recipes
+from .common.renditions import schedule_renditions
 from .common.validation_errors import DETAILS
-from .models import Ingredient, IngredientAmount, Recipe, Tag
+from .fields import RenditionField
+from .models import (FavoriteAndShoppingCart, Ingredient, IngredientAmount,
+                     Recipe, ShoppingListItem, Tag)
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -17,11 +23,7 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 class IngredientAmountSerializer(serializers.ModelSerializer):
     """Serialize and represent ingredients with amount in recipes"""
-    id = serializers.SlugRelatedField(
-        source='ingredient',
-        slug_field='id',
-        queryset=Ingredient.objects.all()
-    )
+    id = serializers.IntegerField(source='ingredient_id')
     name = serializers.SlugRelatedField(
         source='ingredient',
         slug_field='name',
@@ -47,24 +49,42 @@ class TagSerializer(serializers.ModelSerializer):
 
 
 class FavoriteAndShoppingCartSerializer(serializers.ModelSerializer):
+    image_thumbnail = RenditionField()
 
     class Meta:
         model = Recipe
-        fields = ['id', 'name', 'image', 'cooking_time']
+        fields = ['id', 'name', 'image', 'image_thumbnail', 'cooking_time']
         read_only_fields = ['id', 'name', 'image', 'cooking_time']
 
 
+class ShoppingListItemSerializer(serializers.Serializer):
+    """Represent line of user's shopping list"""
+    name = serializers.CharField()
+    amount = serializers.ReadOnlyField()
+    measurement_unit = serializers.CharField()
+
+
+class RecipeListSerializer(SubscriptionsListSerializer):
+
+    def user_ids(self, items):
+        return [recipe.author_id for recipe in items]
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     ingredients = IngredientAmountSerializer(many=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField()
+    image_thumbnail = RenditionField()
+    image_card = RenditionField()
 
     def get_is_favorited(self, recipe):
         request = self.context.get('request')
         if not request or not request.user.is_authenticated:
             return False
+        if hasattr(recipe, 'favorited'):
+            return recipe.favorited
         return recipe.is_favorited.filter(
             user=request.user,
             is_favorited=True
@@ -74,6 +94,8 @@ class RecipeSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if not request or not request.user.is_authenticated:
             return False
+        if hasattr(recipe, 'in_shopping_cart'):
+            return recipe.in_shopping_cart
         return recipe.is_favorited.filter(
             user=request.user,
             is_in_shopping_cart=True
@@ -81,20 +103,25 @@ class RecipeSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         self.fields['tags'] = TagSerializer(many=True)
+        prefetch_related_objects([instance], 'ingredients__ingredient', 'tags')
         return super().to_representation(instance)
 
     def validate(self, data):
         ingredients = data['ingredients']
+        ingredient_objects = Ingredient.objects.in_bulk(
+            [ingredient['ingredient_id'] for ingredient in ingredients]
+        )
         ingredients_dict = {}
         for ingredient in ingredients:
-            ingredient_obj = ingredient['ingredient']
+            pk = ingredient['ingredient_id']
             amount = ingredient['amount']
-            pk = ingredient_obj.pk
+            if pk not in ingredient_objects:
+                raise serializers.ValidationError(DETAILS['ingred'])
             if amount <= 0:
                 raise serializers.ValidationError(DETAILS['amount'])
             if ingredients_dict.get(pk):
                 raise serializers.ValidationError(DETAILS['unique'])
-            ingredients_dict[pk] = (ingredient_obj, amount)
+            ingredients_dict[pk] = (ingredient_objects[pk], amount)
         data['ingredients'] = ingredients_dict
         tags = data['tags']
         tags_list = []
@@ -109,44 +136,95 @@ class RecipeSerializer(serializers.ModelSerializer):
 
         return data
 
-    def ingredients_create_or_update(self, method, ingredients, recipe):
-        method_actions = {
-            'create': IngredientAmount.objects.create,
-            'update': IngredientAmount.objects.update_or_create
+    def ingredients_create(self, ingredients, recipe):
+        IngredientAmount.objects.bulk_create([
+            IngredientAmount(ingredient=ingredient, recipe=recipe,
+                             amount=amount)
+            for ingredient, amount in ingredients.values()
+        ])
+
+    def ingredients_update(self, ingredients, recipe):
+        """Deletes, updates and creates only changed ingredients, in bulk"""
+        existing = {
+            ingredient_amount.ingredient_id: ingredient_amount
+            for ingredient_amount in IngredientAmount.objects.filter(
+                recipe=recipe
+            )
         }
-        for ingredient, amount in ingredients.values():
-            method_actions[method](
-                ingredient=ingredient,
+        removed = existing.keys() - ingredients.keys()
+        if removed:
+            IngredientAmount.objects.filter(
                 recipe=recipe,
-                amount=amount
+                ingredient_id__in=removed
+            ).delete()
+        changed = []
+        for pk, (ingredient, amount) in ingredients.items():
+            ingredient_amount = existing.get(pk)
+            if ingredient_amount and ingredient_amount.amount != amount:
+                ingredient_amount.amount = amount
+                changed.append(ingredient_amount)
+        if changed:
+            IngredientAmount.objects.bulk_update(changed, ['amount'])
+        added = ingredients.keys() - existing.keys()
+        self.ingredients_create({pk: ingredients[pk] for pk in added}, recipe)
+        touched = removed | added | {
+            ingredient_amount.ingredient_id for ingredient_amount in changed
+        }
+        if touched:
+            ShoppingListItem.objects.refresh(
+                FavoriteAndShoppingCart.objects.filter(
+                    recipe=recipe,
+                    is_in_shopping_cart=True
+                ).values('user_id'),
+                list(touched)
             )
 
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         try:
-            recipe = Recipe.objects.create(**validated_data)
+            with transaction.atomic():
+                recipe = Recipe.objects.create(**validated_data)
+                self.ingredients_create(ingredients, recipe)
+                recipe.tags.add(*tags)
+                index_recipes([recipe.pk])
+                schedule_renditions(recipe.pk)
         except IntegrityError:
             detail = {'detail': 'Вы уже создавали рецепт с таким названием'}
             raise serializers.ValidationError(detail)
-
-        self.ingredients_create_or_update('create', ingredients, recipe)
-        recipe.tags.add(*tags)
+        recipe.favorited = False
+        recipe.in_shopping_cart = False
         return recipe
 
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients')
-        IngredientAmount.objects.filter(recipe=instance).delete()
-        self.ingredients_create_or_update('update', ingredients, instance)
         tags = validated_data.pop('tags')
-        instance.tags.clear()
-        instance.tags.add(*tags)
-        super().update(instance, validated_data)
+        try:
+            with transaction.atomic():
+                self.ingredients_update(ingredients, instance)
+                instance.tags.set(tags)
+                super().update(instance, validated_data)
+                index_recipes([instance.pk])
+                if 'image' in validated_data:
+                    schedule_renditions(instance.pk)
+        except IntegrityError:
+            detail = {'detail': 'Вы уже создавали рецепт с таким названием'}
+            raise serializers.ValidationError(detail)
         return instance
 
     class Meta:
         model = Recipe
+        list_serializer_class = RecipeListSerializer
         fields = ['id', 'tags', 'author', 'ingredients',
                   'is_in_shopping_cart', 'is_favorited',
-                  'name', 'image', 'text', 'cooking_time']
+                  'name', 'image', 'image_thumbnail', 'image_card',
+                  'text', 'cooking_time']
         read_only_fields = ['id', 'author']
+
+
+class CoverageRecipeSerializer(RecipeSerializer):
+    """Recipe with share of its ingredients the user has"""
+    coverage = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ['coverage']
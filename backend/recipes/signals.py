@@ -0,0 +1,128 @@
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .common.catalogue_cache import ingredients_catalogue, tags_catalogue
+from .common.conditional import viewer_changed
+from .common.recipe_search import index_recipes
+from .common.renditions import RENDITIONS
+from .common.shopping_list_cache import ShoppingListCache
+from .models import (FavoriteAndShoppingCart, FeedItem, Ingredient,
+                     IngredientAmount, Recipe, ShoppingListItem, Tag)
+
+
+def invalidate_recipe_in_carts(recipe_id):
+    """Runs after commit, so other workers can't cache the old list again"""
+    transaction.on_commit(lambda: ShoppingListCache().invalidate(
+        FavoriteAndShoppingCart.objects.filter(
+            recipe_id=recipe_id,
+            is_in_shopping_cart=True
+        ).values_list('user_id', flat=True)
+    ))
+
+
+def recipe_cart_holders(recipe_id):
+    return FavoriteAndShoppingCart.objects.filter(
+        recipe_id=recipe_id,
+        is_in_shopping_cart=True
+    ).values('user_id')
+
+
+@receiver([post_save, post_delete], sender=FavoriteAndShoppingCart)
+def shopping_cart_changed(sender, instance, **kwargs):
+    """Changes made with ORM, toggle endpoints refresh lists themselves"""
+    ShoppingListItem.objects.refresh(
+        [instance.user_id],
+        IngredientAmount.objects.filter(
+            recipe_id=instance.recipe_id
+        ).values('ingredient_id')
+    )
+    transaction.on_commit(
+        lambda: ShoppingListCache().invalidate([instance.user_id])
+    )
+    viewer_changed([instance.user_id])
+
+
+def refresh_recipe_in_carts(recipe_id, ingredient_ids):
+    """
+    Shopping lists of users with the recipe in cart, after its amounts
+    of the ingredients changed. Deleted amounts have no post_delete
+    receiver, so bulk deletes stay single queries: admin calls it
+    for rows deleted one by one.
+    """
+    ShoppingListItem.objects.refresh(
+        recipe_cart_holders(recipe_id), ingredient_ids
+    )
+    invalidate_recipe_in_carts(recipe_id)
+
+
+@receiver(post_save, sender=IngredientAmount)
+def ingredient_amount_changed(sender, instance, **kwargs):
+    refresh_recipe_in_carts(instance.recipe_id, [instance.ingredient_id])
+
+
+def delete_files(names):
+    for name in names:
+        default_storage.delete(name)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(sender, instance, **kwargs):
+    """Remembers whose shopping lists lose the recipe ingredients"""
+    instance.cart_holders = list(
+        recipe_cart_holders(instance.pk).values_list('user_id', flat=True)
+    )
+    instance.cart_ingredients = list(
+        instance.ingredients.values_list('ingredient_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    """Renditions belong to the recipe, their files are removed with it"""
+    renditions = [
+        getattr(instance, field).name for field in RENDITIONS
+        if getattr(instance, field)
+    ]
+    if renditions:
+        transaction.on_commit(lambda: delete_files(renditions))
+    if instance.cart_holders:
+        ShoppingListItem.objects.refresh(
+            instance.cart_holders, instance.cart_ingredients
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_changed(sender, instance, created, **kwargs):
+    if created:
+        FeedItem.objects.published(instance)
+    else:
+        invalidate_recipe_in_carts(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    ingredients_catalogue.bump()
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(sender, instance, created, **kwargs):
+    """
+    Renamed ingredient is searched by the new name, shopping lists
+    with it are rendered again with the new name and unit
+    """
+    if not created:
+        index_recipes(Recipe.objects.filter(
+            ingredients__ingredient=instance
+        ).values('pk'))
+        transaction.on_commit(lambda: ShoppingListCache().invalidate(
+            ShoppingListItem.objects.filter(
+                ingredient=instance
+            ).values_list('user_id', flat=True)
+        ))
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(sender, **kwargs):
+    tags_catalogue.bump()
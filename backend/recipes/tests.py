@@ -0,0 +1,530 @@
+import io
+import json
+import re
+import tempfile
+import zlib
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from users.models import User
+
+from .common.pdfmaker import pdf_shopping_list_maker
+from .common.renditions import RENDITIONS, make_renditions
+from .models import (FavoriteAndShoppingCart, Ingredient, IngredientAmount,
+                     Recipe, Tag)
+
+
+class RecipeTestCase(TestCase):
+    """Viewer, three authors and recipes made by `create_recipes()`"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='viewer', email='viewer@example.com',
+            first_name='Viewer', last_name='User', password='viewer-pass'
+        )
+        cls.authors = [
+            User.objects.create_user(
+                username='author{}'.format(number),
+                email='author{}@example.com'.format(number),
+                first_name='Author', last_name='User', password='author-pass'
+            )
+            for number in range(3)
+        ]
+        cls.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast'
+        )
+        cls.ingredient = Ingredient.objects.create(
+            name='мука', measurement_unit='г'
+        )
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_recipes(self, count):
+        Recipe.objects.bulk_create(
+            Recipe(author=self.authors[number % len(self.authors)],
+                   name='Рецепт {}'.format(number),
+                   image='recipe.png', text='Текст', cooking_time=10)
+            for number in range(Recipe.objects.count(), count)
+        )
+        recipes = list(Recipe.objects.all())
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(recipe=recipe, ingredient=self.ingredient,
+                             amount=100)
+            for recipe in Recipe.objects.filter(ingredients=None)
+        )
+        Recipe.tags.through.objects.bulk_create(
+            [Recipe.tags.through(recipe_id=recipe.pk, tag_id=self.tag.pk)
+             for recipe in recipes],
+            ignore_conflicts=True
+        )
+        return recipes
+
+
+class RecipeListQueriesTest(RecipeTestCase):
+    """Recipe list costs the same number of queries for any page size"""
+
+    def get_flag_queries(self, params):
+        """Response and queries reading favorites and shopping cart"""
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/recipes/', params)
+        return response, [
+            query['sql'] for query in context.captured_queries
+            if FavoriteAndShoppingCart._meta.db_table in query['sql']
+        ]
+
+    def test_flags_do_not_add_queries_per_recipe(self):
+        recipes = self.create_recipes(20)
+        FavoriteAndShoppingCart.objects.create(
+            user=self.user, recipe=recipes[0],
+            is_favorited=True, is_in_shopping_cart=True
+        )
+        small, small_queries = self.get_flag_queries({'limit': 2})
+        large, large_queries = self.get_flag_queries({'limit': 20})
+        # flags are subqueries of the count and the page queries
+        self.assertEqual(len(small_queries), 2)
+        self.assertEqual(len(large_queries), 2)
+        self.assertEqual(len(small.data['results']), 2)
+        self.assertEqual(len(large.data['results']), 20)
+        flags = {
+            recipe['id']: (recipe['is_favorited'],
+                           recipe['is_in_shopping_cart'])
+            for recipe in large.data['results']
+        }
+        self.assertEqual(flags.pop(recipes[0].pk), (True, True))
+        self.assertEqual(set(flags.values()), {(False, False)})
+
+    def test_list_queries_do_not_grow_with_page_size(self):
+        """
+        Count, recipes, ingredients and tags queries; anonymous viewer
+        adds the ETag aggregate, authenticated one adds subscriptions
+        of the page and gets no ETag from a process-local cache
+        """
+        self.authors[0].followings.create(user=self.user)
+        self.create_recipes(1000)
+        anonymous = APIClient()
+        for limit in (6, 100, 1000):
+            for client, queries in ((self.client, 5), (anonymous, 5)):
+                with self.subTest(limit=limit, queries=queries):
+                    with self.assertNumQueries(queries):
+                        response = client.get('/api/recipes/',
+                                              {'limit': limit})
+                    self.assertEqual(len(response.data['results']), limit)
+
+
+class RecipeCursorPaginationTest(RecipeTestCase):
+    """Cursor pages are allowed only in the default order"""
+
+    def test_cursor_pages_cover_all_recipes_once(self):
+        recipes = self.create_recipes(7)
+        response = self.client.get('/api/recipes/', {'cursor': '',
+                                                     'limit': 3})
+        seen = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            seen.extend(recipe['id'] for recipe in response.data['results'])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(sorted(seen), sorted(recipe.pk for recipe in recipes))
+
+    def test_cursor_with_other_ordering_or_search_is_refused(self):
+        """Counters are full of ties, cursor would fall back to OFFSET"""
+        self.create_recipes(3)
+        for params in ({'ordering': 'pub_date'}, {'search': 'Рецепт'},
+                       {'ordering': '-favorites_count'},
+                       {'ordering': '-cart_count'}):
+            with self.subTest(**params):
+                response = self.client.get('/api/recipes/',
+                                           dict(params, cursor=''))
+                self.assertEqual(response.status_code, 400)
+                response = self.client.get('/api/recipes/', params)
+                self.assertEqual(response.status_code, 200)
+
+
+class FlagToggleTest(RecipeTestCase):
+    """Favorite and shopping cart toggles keep rows and counters in sync"""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe, self.other_recipe = self.create_recipes(2)
+        self.other = APIClient()
+        self.other.force_authenticate(self.authors[0])
+
+    def url(self, action, recipe=None):
+        return '/api/recipes/{}/{}/'.format((recipe or self.recipe).pk,
+                                            action)
+
+    def assert_state(self, favorites, carts):
+        self.recipe.refresh_from_db()
+        self.assertEqual(
+            (self.recipe.favorites_count, self.recipe.cart_count),
+            (favorites, carts)
+        )
+        rows = self.recipe.is_favorited
+        self.assertEqual(
+            (rows.filter(is_favorited=True).count(),
+             rows.filter(is_in_shopping_cart=True).count()),
+            (favorites, carts)
+        )
+
+    def test_add_and_remove(self):
+        response = self.client.get(self.url('favorite'))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['id'], self.recipe.pk)
+        self.assertEqual(response.data['name'], self.recipe.name)
+        self.assertEqual(
+            self.client.get(self.url('shopping_cart')).status_code, 201
+        )
+        self.assertEqual(self.other.get(self.url('favorite')).status_code,
+                         201)
+        self.assert_state(2, 1)
+        self.assertEqual(
+            self.client.delete(self.url('favorite')).status_code, 204
+        )
+        self.assert_state(1, 1)
+        self.assertEqual(
+            self.client.delete(self.url('shopping_cart')).status_code, 204
+        )
+        self.assert_state(1, 0)
+        self.assertFalse(FavoriteAndShoppingCart.objects.filter(
+            user=self.user
+        ).exists())
+
+    def test_repeated_add_is_bad_request(self):
+        self.client.get(self.url('favorite'))
+        response = self.client.get(self.url('favorite'))
+        self.assertEqual(response.status_code, 400)
+        self.assert_state(1, 0)
+
+    def test_missing_flag_or_recipe_is_not_found(self):
+        missing = Recipe(pk=self.other_recipe.pk + 1000)
+        for action in ('favorite', 'shopping_cart'):
+            with self.subTest(action=action):
+                self.assertEqual(
+                    self.client.delete(self.url(action)).status_code, 404
+                )
+                self.assertEqual(
+                    self.client.get(self.url(action, missing)).status_code,
+                    404
+                )
+                self.assertEqual(
+                    self.client.delete(self.url(action, missing)).status_code,
+                    404
+                )
+        self.assert_state(0, 0)
+        self.assertFalse(FavoriteAndShoppingCart.objects.exists())
+
+    def test_row_left_without_flags_is_deleted(self):
+        """
+        Concurrent removal clears the other flag between DELETE
+        and UPDATE of remove_flag
+        """
+        FavoriteAndShoppingCart.objects.create(
+            user=self.user, recipe=self.recipe,
+            is_favorited=True, is_in_shopping_cart=True
+        )
+        manager = FavoriteAndShoppingCart.objects
+        execute = manager.execute
+
+        def interleaved(sql, *args, **kwargs):
+            try:
+                return execute(sql, *args, **kwargs)
+            finally:
+                if sql.startswith('DELETE'):
+                    manager.filter(user=self.user).update(
+                        is_in_shopping_cart=False
+                    )
+
+        with mock.patch.object(manager, 'execute', interleaved):
+            self.assertEqual(
+                manager.remove_flag(self.user.pk, self.recipe.pk,
+                                    'is_favorited'),
+                (False, False)
+            )
+        self.assertFalse(manager.exists())
+
+    def test_batch_keeps_counters(self):
+        ids = [self.recipe.pk, self.other_recipe.pk]
+        self.client.get(self.url('favorite'))
+        response = self.client.post('/api/recipes/batch/favorite/',
+                                    {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.client.post('/api/recipes/batch/shopping_cart/',
+                         {'ids': ids}, format='json')
+        self.assert_state(1, 1)
+        self.client.delete('/api/recipes/batch/favorite/',
+                           {'ids': ids}, format='json')
+        self.client.delete('/api/recipes/batch/shopping_cart/',
+                           {'ids': ids}, format='json')
+        self.assert_state(0, 0)
+        self.other_recipe.refresh_from_db()
+        self.assertEqual((self.other_recipe.favorites_count,
+                          self.other_recipe.cart_count), (0, 0))
+        self.assertFalse(FavoriteAndShoppingCart.objects.exists())
+
+
+class ConditionalRecipeTest(RecipeTestCase):
+    """ETag of recipe list and detail changes with everything they show"""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe, = self.create_recipes(1)
+        self.anonymous = APIClient()
+        self.urls = ['/api/recipes/',
+                     '/api/recipes/{}/'.format(self.recipe.pk)]
+
+    def etags(self, client=None):
+        client = client or self.anonymous
+        etags = []
+        for url in self.urls:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.has_header('Last-Modified'))
+            etags.append(response['ETag'])
+            self.assertEqual(
+                client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                .status_code,
+                304
+            )
+        return etags
+
+    def assert_changed(self, etags, client=None):
+        client = client or self.anonymous
+        for url, etag in zip(self.urls, etags):
+            with self.subTest(url=url):
+                self.assertEqual(
+                    client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200
+                )
+
+    def test_recipe_change(self):
+        etags = self.etags()
+        self.recipe.text = 'Новый текст'
+        self.recipe.save()
+        self.assert_changed(etags)
+
+    def test_tag_and_ingredient_rename(self):
+        for item in (self.tag, self.ingredient):
+            with self.subTest(item=item):
+                etags = self.etags()
+                item.name = item.name + ' новый'
+                item.save()
+                self.assert_changed(etags)
+
+    def test_favorites_counter(self):
+        etags = self.etags()
+        self.client.get('/api/recipes/{}/favorite/'.format(self.recipe.pk))
+        self.assert_changed(etags)
+
+    def test_deleted_recipe(self):
+        self.create_recipes(2)
+        other = Recipe.objects.exclude(pk=self.recipe.pk).get()
+        list_etag, _ = self.etags()
+        other.delete()
+        response = self.anonymous.get(
+            self.urls[0], HTTP_IF_NONE_MATCH=list_etag,
+            HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_errors_have_no_etag(self):
+        response = self.anonymous.get(self.urls[0], {'cursor': '',
+                                                     'ordering': 'pub_date'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_viewer_needs_shared_cache(self):
+        self.assertFalse(self.client.get(self.urls[0]).has_header('ETag'))
+        with tempfile.TemporaryDirectory() as location:
+            with override_settings(CACHES=dict(settings.CACHES, default={
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            })):
+                etags = self.etags(self.client)
+                self.client.get(
+                    '/api/recipes/{}/shopping_cart/'.format(self.recipe.pk)
+                )
+                self.assert_changed(etags, self.client)
+
+
+class LoadDataTest(TestCase):
+    """Runs COPY on PostgreSQL and bulk_create on other databases"""
+
+    rows = [('гастропаб', ''), ('мука', 'г'), ('соль', 'по вкусу')]
+
+    def load(self, suffix, content):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix,
+                                         encoding='utf-8') as data:
+            data.write(content)
+            data.flush()
+            call_command('load_data', data.name, stdout=io.StringIO())
+        return set(Ingredient.objects.values_list('name',
+                                                  'measurement_unit'))
+
+    def test_csv_rows_with_empty_unit_are_loaded(self):
+        content = ''.join('{},{}\n'.format(*row) for row in self.rows)
+        self.assertEqual(self.load('.csv', content), set(self.rows))
+
+    def test_json_rows_with_empty_unit_are_loaded(self):
+        content = json.dumps([
+            {'name': name, 'measurement_unit': measurement_unit}
+            for name, measurement_unit in self.rows
+        ])
+        self.assertEqual(self.load('.json', content), set(self.rows))
+
+    def test_loading_twice_keeps_one_copy(self):
+        content = ''.join('{},{}\n'.format(*row) for row in self.rows)
+        self.load('.csv', content)
+        self.assertEqual(self.load('.csv', content), set(self.rows))
+        self.assertEqual(Ingredient.objects.count(), len(self.rows))
+
+
+class ShoppingListPDFTest(SimpleTestCase):
+    """Reads the text back through the xref table and ToUnicode maps"""
+
+    def parse(self, document):
+        """Objects by id, streams decompressed"""
+        self.assertTrue(document.startswith(b'%PDF-1.4\n'))
+        self.assertTrue(document.endswith(b'%%EOF\n'))
+        startxref = int(document.rsplit(b'startxref\n', 1)[1].split()[0])
+        self.assertTrue(document[startxref:].startswith(b'xref\n0 '))
+        lines = document[startxref:].split(b'\n')
+        size = int(lines[1].split()[1])
+        objects = {}
+        for object_id, entry in enumerate(lines[3:size + 2], 1):
+            header = b'%d 0 obj\n' % object_id
+            body = document[int(entry[:10]):]
+            self.assertTrue(body.startswith(header))
+            body = body[len(header):]
+            length = re.match(rb'<< /Length (\d+) ', body)
+            if length is None:
+                objects[object_id] = body[:body.index(b'\nendobj\n')]
+                continue
+            start = body.index(b'>>\nstream\n') + len(b'>>\nstream\n')
+            end = start + int(length[1])
+            self.assertTrue(body[end:].startswith(b'\nendstream\nendobj'))
+            objects[object_id] = zlib.decompress(body[start:end])
+        return objects
+
+    def pages_text(self, document):
+        """Text lines of every page, drawn with the embedded font"""
+        objects = self.parse(document)
+        fonts = {}
+        for number, font_id in re.findall(rb'/F(\d+) (\d+) 0 R',
+                                          objects[3]):
+            cmap_id = re.search(rb'/ToUnicode (\d+) 0 R',
+                                objects[int(font_id)])[1]
+            fonts[number] = {
+                int(code, 16): chr(int(char, 16)) for code, char in
+                re.findall(rb'<(\w\w)> <(\w+)>', objects[int(cmap_id)])
+            }
+        kids, count = re.search(rb'/Kids \[(.*)\] /Count (\d+)',
+                                objects[2]).groups()
+        page_ids = re.findall(rb'(\d+) 0 R', kids)
+        self.assertEqual(len(page_ids), int(count))
+        pages = []
+        for page_id in page_ids:
+            content_id = re.search(rb'/Contents (\d+) 0 R',
+                                   objects[int(page_id)])[1]
+            lines = []
+            for line in objects[int(content_id)].split(b'\n'):
+                runs = re.findall(rb'/F(\d+) \d+ Tf <(\w*)> Tj', line)
+                if runs:
+                    lines.append(''.join(
+                        fonts[number][code]
+                        for number, codes in runs
+                        for code in bytes.fromhex(codes.decode())
+                    ))
+            pages.append(lines)
+        return pages
+
+    def test_cyrillic_rows_on_several_pages(self):
+        rows = [('мука {}'.format(number), number, 'г')
+                for number in range(50)]
+        # caseless arrows and operators need a second 256-glyph subset
+        rows.append((''.join(map(chr, range(0x2190, 0x2290))), 1, 'шт'))
+        rows.append((''.join(map(chr, range(0x430, 0x450))), 2, 'ст. л.'))
+        document = b''.join(pdf_shopping_list_maker(rows))
+        self.assertIn(b'/F1 ', document)
+        pages = self.pages_text(document)
+        self.assertEqual(len(pages), 3)
+        self.assertEqual(pages[0][0], 'Список покупок Foodgram')
+        self.assertEqual(
+            [line for page in pages for line in page][1:],
+            ['{} {} {}'.format(name.capitalize(), amount, unit)
+             for name, amount, unit in rows]
+        )
+
+
+class RenditionsTest(RecipeTestCase):
+    """Renditions keep recipe ETags and are deleted with the recipe"""
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        image = io.BytesIO()
+        Image.new('RGB', (800, 600), 'orange').save(image, 'PNG')
+        recipe, = self.create_recipes(1)
+        recipe.image = default_storage.save('recipe.png',
+                                            ContentFile(image.getvalue()))
+        recipe.save()
+        self.recipe = Recipe.objects.get(pk=recipe.pk)
+
+    def test_renditions_keep_updated_at(self):
+        make_renditions(self.recipe.pk)
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        self.assertEqual(recipe.updated_at, self.recipe.updated_at)
+        for field in RENDITIONS:
+            self.assertTrue(default_storage.exists(getattr(recipe,
+                                                           field).name))
+
+    def test_deleted_recipe_leaves_no_renditions(self):
+        make_renditions(self.recipe.pk)
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        with mock.patch.object(transaction, 'on_commit',
+                               side_effect=lambda func: func()):
+            recipe.delete()
+        for field in RENDITIONS:
+            self.assertFalse(default_storage.exists(getattr(recipe,
+                                                            field).name))
+
+
+class ShoppingListCacheTest(RecipeTestCase):
+    """Cached shopping lists follow ingredient renames"""
+
+    def download(self):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', {'format': 'txt'}
+        )
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_renamed_ingredient_is_shown(self):
+        recipe, = self.create_recipes(1)
+        self.client.get('/api/recipes/{}/shopping_cart/'.format(recipe.pk))
+        self.assertIn('Мука - 100 г', self.download())
+        with mock.patch.object(transaction, 'on_commit',
+                               side_effect=lambda func: func()):
+            self.ingredient.name = 'мука пшеничная'
+            self.ingredient.measurement_unit = 'кг'
+            self.ingredient.save()
+        self.assertIn('Мука пшеничная - 100 кг', self.download())
@@ -1,5 +1,9 @@
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Prefetch
+from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
 from rest_framework.decorators import action
@@ -8,42 +12,76 @@ from rest_framework.permissions import (IsAuthenticated,
 from rest_framework.response import Response
 from rest_framework.viewsets import ReadOnlyModelViewSet
 
-from users.pagination import CustomResultsPagination
-from .common.pdfmaker import pdf_shopping_list_maker
-from .filters import IngredientFilter, RecipeFilter
-from .models import FavoriteAndShoppingCart, Ingredient, Recipe, Tag
+from foodgram.metrics import SerializationMetricsMixin
+from users.pagination import (CustomResultsPagination, FeedCursorPagination,
+                              RecipePagination)
+from users.serializers import BatchSerializer
+
+from .common.catalogue_cache import ingredients_catalogue, tags_catalogue
+from .common.conditional import viewer_changed
+from .common.coverage import recipes_by_coverage
+from .common.ingredient_search import search_ingredients
+from .common.shopping_list import (EXPORT_FORMATS, make_shopping_list,
+                                   shopping_list_response)
+from .common.shopping_list_cache import ShoppingListCache
+from .common.units import summed_by_name
+from .common.validation_errors import DETAILS
+from .filters import RecipeFilter, RecipeOrderingFilter
+from .models import (FavoriteAndShoppingCart, FeedItem, Ingredient,
+                     IngredientAmount, Recipe, ShoppingListItem, Tag)
+from .negotiation import FirstRendererNegotiation
 from .permissions import IsAuthorOrReadOnly
-from .serializers import (FavoriteAndShoppingCartSerializer,
+from .serializers import (CoverageRecipeSerializer,
+                          FavoriteAndShoppingCartSerializer,
                           IngredientSerializer, RecipeSerializer,
-                          TagSerializer)
-from .viewsets import ModelCUVDViewSet
+                          ShoppingListItemSerializer, TagSerializer)
+from .viewsets import (CatalogueCacheMixin, ConditionalRecipeMixin,
+                       ModelCUVDViewSet)
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(CatalogueCacheMixin, SerializationMetricsMixin,
+                 ReadOnlyModelViewSet):
     'Viewset для тэгов, только для просмотра'
+    catalogue = tags_catalogue
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(CatalogueCacheMixin, SerializationMetricsMixin,
+                        ReadOnlyModelViewSet):
     'Viewset для ингредиентов, только для просмотра'
+    catalogue = ingredients_catalogue
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filter_backends = [DjangoFilterBackend]
-    filterset_class = IngredientFilter
-    filterset_fields = ('name',)
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        """'?name=' switches to autocomplete search with capped result"""
+        name = request.query_params.get('name')
+        if name is None:
+            return super().list(request, *args, **kwargs)
+        serializer = self.get_serializer(search_ingredients(name), many=True)
+        return Response(serializer.data)
+
 
-class RecipeViewSet(ModelCUVDViewSet):
+class RecipeViewSet(ConditionalRecipeMixin, ModelCUVDViewSet):
     'Viewset for recipe with urls_path methods'
-    queryset = Recipe.objects.prefetch_related('ingredients').all()
+    queryset = Recipe.objects.prefetch_related(
+        Prefetch(
+            'ingredients',
+            queryset=IngredientAmount.objects.select_related('ingredient')
+        ),
+        'tags'
+    )
     serializer_class = RecipeSerializer
     permission_classes = [IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
-    pagination_class = CustomResultsPagination
-    filter_backends = [DjangoFilterBackend]
+    pagination_class = RecipePagination
+    lookup_value_regex = r'\d+'
+    filter_backends = [DjangoFilterBackend, RecipeOrderingFilter]
     filterset_class = RecipeFilter
+    ordering_fields = ('favorites_count', 'cart_count', 'pub_date')
+    ordering = ('-pub_date',)
     filterset_fields = (
         'is_favorited',
         'is_in_shopping_cart',
@@ -51,111 +89,268 @@ class RecipeViewSet(ModelCUVDViewSet):
         'tags'
     )
 
+    def get_queryset(self):
+        """Annotate favorite and shopping cart flags of the current user,
+        so a page costs a constant number of queries. Subscriptions
+        to authors are looked up by serializer for the whole page"""
+        queryset = super().get_queryset().select_related('author')
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset
+        user_recipes = FavoriteAndShoppingCart.objects.filter(
+            user=user,
+            recipe=OuterRef('pk')
+        )
+        return queryset.annotate(
+            favorited=Exists(user_recipes.filter(is_favorited=True)),
+            in_shopping_cart=Exists(
+                user_recipes.filter(is_in_shopping_cart=True)
+            )
+        )
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
     def perform_update(self, serializer):
         serializer.save(author=self.request.user)
 
-    def favorite_shopping_cart_add(self, defaults):
-        recipe = defaults.get('recipe')
-        user = defaults.get('user')
-        if defaults.get('is_favorited'):
-            try:
-                check_already = recipe.is_favorited.get().is_favorited
-            except FavoriteAndShoppingCart.DoesNotExist:
-                check_already = False
-            detail = {'detail': 'Рецепт уже в избранном'}
-
-        if defaults.get('is_in_shopping_cart'):
-            try:
-                check_already = recipe.is_favorited.get().is_in_shopping_cart
-            except FavoriteAndShoppingCart.DoesNotExist:
-                check_already = False
-            detail = {'detail': 'Рецепт уже в корзине'}
-
-        if check_already:
-            return Response(detail, status.HTTP_400_BAD_REQUEST)
-
-        FavoriteAndShoppingCart.objects.update_or_create(
-            recipe=recipe,
-            user=user,
-            defaults=defaults
+    def flag_changed(self, user, recipe_ids, flag, delta, fields=('id',)):
+        """
+        Updates popularity counter and returns the recipes with `fields`,
+        shopping list follows the cart
+        """
+        viewer_changed([user.id])
+        if flag == 'is_in_shopping_cart':
+            ShoppingListItem.objects.refresh(
+                [user.id],
+                IngredientAmount.objects.filter(
+                    recipe_id__in=recipe_ids
+                ).values('ingredient_id')
+            )
+            transaction.on_commit(
+                lambda: ShoppingListCache().invalidate([user.id])
+            )
+        return FavoriteAndShoppingCart.objects.change_counter(
+            recipe_ids, flag, delta, fields
         )
+
+    def favorite_shopping_cart_add(self, flag, detail):
+        """Recipe is looked up only when nothing was flagged, for 404"""
+        user = self.request.user
+        recipe_id = self.kwargs['pk']
+        with transaction.atomic():
+            if FavoriteAndShoppingCart.objects.add_flag(
+                user.id, recipe_id, flag
+            ) is None:
+                get_object_or_404(Recipe.objects.only('id'), pk=recipe_id)
+                return Response({'detail': detail},
+                                status.HTTP_400_BAD_REQUEST)
+            recipe, = self.flag_changed(
+                user, [recipe_id], flag, 1,
+                FavoriteAndShoppingCartSerializer.Meta.fields
+            )
         return Response(
             FavoriteAndShoppingCartSerializer(recipe).data,
             status=status.HTTP_201_CREATED
         )
 
-    def favorite_shopping_cart_delete(self, defaults):
-        favorite_obj = get_object_or_404(
-            FavoriteAndShoppingCart,
-            recipe=defaults['recipe'], user=defaults['user']
-        )
-        if defaults.get('is_favorited'):
-            favorite_obj.is_favorited = False
-        if defaults.get('is_in_shopping_cart'):
-            favorite_obj.is_in_shopping_cart = False
-
-        favorite_obj.save()
-        if favorite_obj.is_favorited == favorite_obj.is_in_shopping_cart:
-            favorite_obj.delete()
-
+    def favorite_shopping_cart_delete(self, flag):
+        user = self.request.user
+        recipe_id = self.kwargs['pk']
+        with transaction.atomic():
+            if FavoriteAndShoppingCart.objects.remove_flag(
+                user.id, recipe_id, flag
+            ) is None:
+                raise Http404
+            self.flag_changed(user, [recipe_id], flag, -1)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def favorite_shopping_cart_batch(self, request, flag):
+        """
+        Sets or clears the flag for recipes from '{"ids": [...]}' at once,
+        returns status of every id: added, removed, unchanged (already
+        set) or not_found
+        """
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        user = request.user
+        with transaction.atomic():
+            if request.method == 'DELETE':
+                changed = FavoriteAndShoppingCart.objects.remove_flags(
+                    user.id, ids, flag
+                )
+                statuses = {pk: 'removed' for pk in changed}
+            else:
+                found = list(Recipe.objects.filter(
+                    pk__in=ids
+                ).values_list('pk', flat=True))
+                changed = FavoriteAndShoppingCart.objects.add_flags(
+                    user.id, found, flag
+                ) if found else set()
+                statuses = {
+                    pk: 'added' if pk in changed else 'unchanged'
+                    for pk in found
+                }
+            if changed:
+                self.flag_changed(user, changed, flag,
+                                  -1 if request.method == 'DELETE' else 1)
+        return Response(serializer.results(ids, statuses))
+
     @action(['get', 'delete'],
             detail=True,
             permission_classes=[IsAuthenticated])
     def favorite(self, request, pk=None):
         """View for GET and DELETE recipe to or from favorite"""
-        defaults = {
-            'user': self.request.user,
-            'recipe': self.get_object(),
-            'is_favorited': True
-        }
         if request.method == 'GET':
-            return self.favorite_shopping_cart_add(defaults=defaults)
-        if request.method == 'DELETE':
-            return self.favorite_shopping_cart_delete(defaults=defaults)
+            return self.favorite_shopping_cart_add(
+                'is_favorited', 'Рецепт уже в избранном'
+            )
+        return self.favorite_shopping_cart_delete('is_favorited')
 
     @action(methods=['GET', 'DELETE'],
             detail=True,
             permission_classes=[IsAuthenticated])
     def shopping_cart(self, request, pk=None):
         """View for GET and DELETE recipe to or from shoppingcart"""
-        defaults = {
-            'user': self.request.user,
-            'recipe': self.get_object(),
-            'is_in_shopping_cart': True
-        }
         if request.method == 'GET':
-            return self.favorite_shopping_cart_add(defaults=defaults)
-        if request.method == 'DELETE':
-            return self.favorite_shopping_cart_delete(defaults=defaults)
+            return self.favorite_shopping_cart_add(
+                'is_in_shopping_cart', 'Рецепт уже в корзине'
+            )
+        return self.favorite_shopping_cart_delete('is_in_shopping_cart')
 
-    @action(methods=['GET'],
+    @action(methods=['POST', 'DELETE'],
+            detail=False,
+            url_path='batch/favorite',
+            url_name='favorite-batch',
+            permission_classes=[IsAuthenticated])
+    def favorite_batch(self, request):
+        return self.favorite_shopping_cart_batch(request, 'is_favorited')
+
+    @action(methods=['POST', 'DELETE'],
             detail=False,
+            url_path='batch/shopping_cart',
+            url_name='shopping-cart-batch',
             permission_classes=[IsAuthenticated])
+    def shopping_cart_batch(self, request):
+        return self.favorite_shopping_cart_batch(
+            request, 'is_in_shopping_cart'
+        )
+
+    @action(methods=['GET'],
+            detail=False,
+            permission_classes=[IsAuthenticated],
+            filter_backends=[],
+            pagination_class=FeedCursorPagination)
+    def feed(self, request):
+        """
+        Recipes of followed authors, newest first, with keyset pagination.
+        Users with many follows read precomputed feed by their index,
+        others join recipes of followed authors.
+        """
+        user = request.user
+        queryset = self.get_queryset()
+        if FeedItem.objects.is_precomputed(user.id):
+            queryset = queryset.filter(feed_items__user=user).annotate(
+                feed_pub_date=F('feed_items__pub_date')
+            )
+        else:
+            queryset = queryset.filter(
+                author__followings__user=user
+            ).annotate(feed_pub_date=F('pub_date'))
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['GET'],
+            detail=False,
+            pagination_class=CustomResultsPagination)
+    def what_to_cook(self, request):
+        """
+        Recipes ranked by share of their ingredients among given ones:
+        '?ingredients=1,2,3&min_coverage=0.5'
+        """
+        try:
+            ingredient_ids = [
+                int(pk)
+                for value in request.query_params.getlist('ingredients')
+                for pk in value.split(',') if pk
+            ]
+            min_coverage = float(request.query_params.get('min_coverage', 0))
+        except ValueError:
+            return Response(DETAILS['coverage'], status.HTTP_400_BAD_REQUEST)
+        if not ingredient_ids or not 0 <= min_coverage <= 1:
+            return Response(DETAILS['coverage'], status.HTTP_400_BAD_REQUEST)
+        page = self.paginate_queryset(
+            recipes_by_coverage(ingredient_ids, min_coverage)
+        )
+        recipes = self.get_queryset().in_bulk([pk for pk, _ in page])
+        for pk, coverage in page:
+            recipes[pk].coverage = coverage
+        serializer = CoverageRecipeSerializer(
+            [recipes[pk] for pk, _ in page],
+            many=True,
+            context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['GET'],
+            detail=False,
+            url_path='shopping_cart',
+            url_name='shopping-cart-preview',
+            permission_classes=[IsAuthenticated],
+            pagination_class=None)
+    def shopping_cart_preview(self, request):
+        """Shopping list of the user as JSON, same lines as in download"""
+        rows = [
+            {'name': name, 'amount': amount, 'measurement_unit': unit}
+            for name, amount, unit in self.shopping_list_rows(request.user)
+        ]
+        return Response(ShoppingListItemSerializer(rows, many=True).data)
+
+    @action(methods=['GET'],
+            detail=False,
+            permission_classes=[IsAuthenticated],
+            content_negotiation_class=FirstRendererNegotiation)
     def download_shopping_cart(self, request, pk=None):
-        """Method exporting shopping list to PDF, used 'reportlab' lib"""
-        shopping_list = {}
+        """Method returning shopping list as pdf, csv or txt ('?format=')"""
+        export_format = request.query_params.get('format', 'pdf')
+        if export_format not in EXPORT_FORMATS:
+            return Response(DETAILS['format'], status.HTTP_400_BAD_REQUEST)
         user = self.request.user
-        recipes = Recipe.objects.filter(
-            is_favorited__user=user,
-            is_favorited__is_in_shopping_cart=True
-        )
-        ingredients = recipes.values(
-            'ingredients__ingredient__name',
-            'ingredients__ingredient__measurement_unit').order_by(
-            'ingredients__ingredient__name').annotate(
-            ingredients_sum=Sum('ingredients__amount')
+        shopping_lists = ShoppingListCache()
+        rows = None
+        digest = shopping_lists.digest(user.id, export_format)
+        if digest is None:
+            rows = self.shopping_list_rows(user)
+            if not rows:
+                return Response('Ваша корзина пуста')
+            digest = shopping_lists.remember(user.id, export_format, rows)
+        etag = quote_etag(digest)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            document = shopping_lists.document(digest)
+            if document is None:
+                if rows is None:
+                    rows = self.shopping_list_rows(user)
+                document = shopping_lists.store(
+                    digest,
+                    make_shopping_list(rows, export_format)
+                )
+            else:
+                document = [document]
+            response = shopping_list_response(document, export_format)
+        response['ETag'] = etag
+        return response
+
+    def shopping_list_rows(self, user):
+        """
+        Precomputed shopping list items of the user, one line per name
+        with convertible units (г and кг, ...) merged
+        """
+        return summed_by_name(
+            ShoppingListItem.objects.filter(user=user),
+            'ingredient__name',
+            'amount',
+            'ingredient__measurement_unit'
         )
-        if not recipes:
-            return Response('Ваша корзина пуста')
-        for product in ingredients:
-            item = product.get('ingredients__ingredient__name')
-            count = str(product.get('ingredients_sum')) + ' ' + product[
-                'ingredients__ingredient__measurement_unit'
-            ]
-            shopping_list[item] = count
-        return pdf_shopping_list_maker(shopping_list)
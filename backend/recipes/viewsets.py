@@ -1,10 +1,21 @@
+from django.conf import settings
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import quote_etag
 from rest_framework.mixins import (CreateModelMixin, DestroyModelMixin,
                                    ListModelMixin, RetrieveModelMixin,
                                    UpdateModelMixin)
+from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
+from foodgram.metrics import SerializationMetricsMixin
 
-class ModelCUVDViewSet(CreateModelMixin,
+from .common.conditional import recipes_etag
+from .models import Recipe
+
+
+class ModelCUVDViewSet(SerializationMetricsMixin,
+                       CreateModelMixin,
                        DestroyModelMixin,
                        ListModelMixin,
                        UpdateModelMixin,
@@ -15,3 +26,59 @@ class ModelCUVDViewSet(CreateModelMixin,
     `destroy()` and `list()` actions for RecipesApp.
     """
     pass
+
+
+class CatalogueCacheMixin:
+    """
+    Serves `list()` from the in-process `catalogue` cache
+    with ETag and Cache-Control headers, 304 for unchanged catalogue.
+    """
+    catalogue = None
+
+    def list(self, request, *args, **kwargs):
+        version = self.catalogue.version()
+        etag = quote_etag('{}-{}'.format(self.catalogue.name, version))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            payload = self.catalogue.get(version)
+            if payload is None:
+                payload = list(super().list(request, *args, **kwargs).data)
+                self.catalogue.set(version, payload)
+            response = Response(payload)
+        response['ETag'] = etag
+        patch_cache_control(response, public=True,
+                            max_age=settings.CATALOGUE_MAX_AGE)
+        return response
+
+
+class ConditionalRecipeMixin:
+    """
+    `list()` and `retrieve()` with weak ETag, 304 before recipes are
+    queried and serialized, if they did not change since the client's
+    copy. Errors, e.g. 400 for wrong query params, get no ETag.
+    """
+
+    def conditional(self, request, queryset, view, *args, **kwargs):
+        etag = recipes_etag(request, queryset)
+        if etag is None:
+            return view(request, *args, **kwargs)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        patch_vary_headers(response, ['Authorization'])
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(
+            request, self.filter_queryset(Recipe.objects.all()),
+            super().list, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(
+            request, Recipe.objects.filter(pk=kwargs[self.lookup_field]),
+            super().retrieve, *args, **kwargs
+        )
@@ -0,0 +1,43 @@
+from .models import Follow
+
+
+class SubscriptionLoader:
+    """
+    Subscriptions of request's user, kept for the request. List
+    serializers prime it with ids of all users on the page, so the page
+    is looked up with one query instead of one per user.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.pending = set()
+        self.subscribed = {}
+
+    @classmethod
+    def for_request(cls, request):
+        loader = getattr(request, 'subscription_loader', None)
+        if loader is None:
+            loader = cls(request.user)
+            request.subscription_loader = loader
+        return loader
+
+    def prime(self, user_ids):
+        self.pending.update(
+            pk for pk in user_ids if pk not in self.subscribed
+        )
+
+    def load(self):
+        following = set(Follow.objects.filter(
+            user=self.user,
+            following_id__in=self.pending
+        ).values_list('following_id', flat=True))
+        self.subscribed.update(
+            (pk, pk in following) for pk in self.pending
+        )
+        self.pending = set()
+
+    def is_subscribed(self, user_id):
+        if user_id not in self.subscribed:
+            self.prime([user_id])
+            self.load()
+        return self.subscribed[user_id]
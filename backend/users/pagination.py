@@ -1,7 +1,70 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import (BasePagination, CursorPagination,
+                                       PageNumberPagination)
 
 
 class CustomResultsPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'limit'
     max_page_size = 1000
+
+
+class UserCursorPagination(CursorPagination):
+    """
+    Only `ordering` is allowed: cursor keeps position of the first
+    ordering field, so with a counter full of ties or search rank
+    it would fall back to OFFSET and skip or repeat rows.
+    """
+    page_size = 10
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+    ordering = ['-id']
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering != tuple(self.ordering):
+            raise ValidationError({'detail': (
+                'Постраничный вывод с cursor доступен только '
+                'с сортировкой по умолчанию и без поиска'
+            )})
+        return ordering
+
+
+class RecipeCursorPagination(UserCursorPagination):
+    ordering = ['-pub_date', '-id']
+
+
+class FeedCursorPagination(UserCursorPagination):
+    """Feed querysets annotate 'feed_pub_date' from its index"""
+    ordering = ['-feed_pub_date', '-id']
+
+
+class OptionalCursorPagination(BasePagination):
+    """
+    Page number pagination by default. With '?cursor=' param (empty for
+    the first page) switches to keyset pagination, which has no COUNT(*)
+    query and no OFFSET scans on deep pages.
+    """
+    cursor_query_param = 'cursor'
+    page_number_class = CustomResultsPagination
+    cursor_class = UserCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params:
+            self.paginator = self.cursor_class()
+        else:
+            self.paginator = self.page_number_class()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_schema_fields(self, view):
+        return self.page_number_class().get_schema_fields(view)
+
+    def get_schema_operation_parameters(self, view):
+        return self.page_number_class().get_schema_operation_parameters(view)
+
+
+class RecipePagination(OptionalCursorPagination):
+    cursor_class = RecipeCursorPagination
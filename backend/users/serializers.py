@@ -1,15 +1,48 @@
+from django.conf import settings
 from django.contrib.auth.password_validation import validate_password
+from django.db import models
 from rest_framework import serializers
 
+from recipes.fields import RenditionField
 from recipes.models import Recipe
+from .loaders import SubscriptionLoader
 from .models import User
 
 
+def get_recipes_limit(request):
+    """'recipes_limit' query param, capped by RECIPES_PREVIEW_MAX_LIMIT"""
+    limit = settings.RECIPES_PREVIEW_LIMIT
+    if request is not None:
+        try:
+            limit = int(request.query_params.get('recipes_limit', limit))
+        except ValueError:
+            pass
+    return min(max(limit, 0), settings.RECIPES_PREVIEW_MAX_LIMIT)
+
+
 class SimpleRecipeSerializer(serializers.ModelSerializer):
     """Serializer for user list view, with short fieldset"""
+    image_thumbnail = RenditionField()
+
     class Meta:
         model = Recipe
-        fields = ['id', 'name', 'image', 'cooking_time']
+        fields = ['id', 'name', 'image', 'image_thumbnail', 'cooking_time']
+
+
+class SubscriptionsListSerializer(serializers.ListSerializer):
+    """Primes subscription loader with users of the whole list"""
+
+    def user_ids(self, items):
+        return [item.pk for item in items]
+
+    def to_representation(self, data):
+        items = data.all() if isinstance(data, models.Manager) else data
+        request = self.context.get('request')
+        if request is not None and request.user.is_authenticated:
+            SubscriptionLoader.for_request(request).prime(
+                self.user_ids(items)
+            )
+        return super().to_representation(items)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -21,7 +54,9 @@ class UserSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if not request or not request.user.is_authenticated:
             return False
-        return request.user.followers.filter(following=obj).exists()
+        if hasattr(obj, 'subscribed'):
+            return obj.subscribed
+        return SubscriptionLoader.for_request(request).is_subscribed(obj.pk)
 
     def create(self, validated_data):
         user = User.objects.create_user(
@@ -36,6 +71,7 @@ class UserSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = User
+        list_serializer_class = SubscriptionsListSerializer
         fields = [
             'email',
             'id',
@@ -49,12 +85,23 @@ class UserSerializer(serializers.ModelSerializer):
 
 class SubscribeSerializer(UserSerializer):
     recipes = serializers.SerializerMethodField()
+    recipes_count = serializers.SerializerMethodField()
 
     def get_recipes(self, obj):
-        recipes_queryset = Recipe.objects.filter(author=obj)
+        """Latest recipes, prefetched as 'recipes_preview' for lists"""
+        if hasattr(obj, 'recipes_preview'):
+            recipes_queryset = obj.recipes_preview
+        else:
+            limit = get_recipes_limit(self.context.get('request'))
+            recipes_queryset = obj.recipes.all()[:limit]
         serializer = SimpleRecipeSerializer(recipes_queryset, many=True)
         return serializer.data
 
+    def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_total'):
+            return obj.recipes_total
+        return obj.recipes.count()
+
     class Meta(UserSerializer.Meta):
         model = User
         fields = [
@@ -64,10 +111,31 @@ class SubscribeSerializer(UserSerializer):
             'first_name',
             'last_name',
             'is_subscribed',
-            'recipes'
+            'recipes',
+            'recipes_count'
         ]
 
 
+class BatchSerializer(serializers.Serializer):
+    """Ids for batch endpoints, repeated ids are dropped"""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BATCH_MAX_SIZE
+    )
+
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
+
+    @staticmethod
+    def results(ids, statuses):
+        """Per item statuses in order of request, 'not_found' by default"""
+        return {'results': [
+            {'id': pk, 'status': statuses.get(pk, 'not_found')}
+            for pk in ids
+        ]}
+
+
 class ChangePasswordSerializer(serializers.Serializer):
     """
     Serializer for password change endpoint.
@@ -1,3 +1,7 @@
+from django.db.models import (BooleanField, Count, F, Prefetch, Value, Window,
+                              prefetch_related_objects)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
 from django.shortcuts import get_object_or_404
 from rest_framework import status
 from rest_framework.decorators import action
@@ -5,10 +9,13 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from recipes.common.conditional import viewer_changed
+from recipes.models import FeedItem, Recipe
 from .models import Follow, User
-from .pagination import CustomResultsPagination
-from .serializers import (ChangePasswordSerializer, SubscribeSerializer,
-                          UserSerializer)
+from .pagination import CustomResultsPagination, OptionalCursorPagination
+from .serializers import (BatchSerializer, ChangePasswordSerializer,
+                          SubscribeSerializer, UserSerializer,
+                          get_recipes_limit)
 from .viewsets import ModelCVViewSet
 
 
@@ -39,6 +46,8 @@ class UserViewSet(ModelCVViewSet):
                 return Response(
                     {'detail': 'Вы уже подписаны на этого пользователя'},
                     status.HTTP_400_BAD_REQUEST)
+            FeedItem.objects.follows_changed(user.id, [following.id])
+            viewer_changed([user.id])
 
             serializer = SubscribeSerializer(
                 following,
@@ -52,26 +61,100 @@ class UserViewSet(ModelCVViewSet):
                 following=following
             )
             subscribe.delete()
+            FeedItem.objects.follows_changed(user.id, [following.id])
+            viewer_changed([user.id])
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(methods=['post', 'delete'],
+            detail=False,
+            url_path='batch/subscribe',
+            url_name='subscribe-batch',
+            permission_classes=[IsAuthenticated])
+    def subscribe_batch(self, request):
+        """
+        Follows or unfollows users from '{"ids": [...]}' at once,
+        returns status of every id: added, removed, unchanged (already
+        followed), invalid (the user himself) or not_found
+        """
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        user = request.user
+        follows = Follow.objects.filter(user=user, following_id__in=ids)
+        followed = set(follows.values_list('following_id', flat=True))
+        if request.method == 'DELETE':
+            follows.delete()
+            FeedItem.objects.follows_changed(user.id, followed)
+            viewer_changed([user.id])
+            return Response(serializer.results(
+                ids, {pk: 'removed' for pk in followed}
+            ))
+        statuses = {
+            pk: 'unchanged' if pk in followed else 'added'
+            for pk in User.objects.filter(
+                pk__in=ids
+            ).values_list('pk', flat=True)
+        }
+        if user.pk in statuses:
+            statuses[user.pk] = 'invalid'
+        added = [pk for pk, state in statuses.items() if state == 'added']
+        Follow.objects.bulk_create(
+            [Follow(user=user, following_id=pk) for pk in added],
+            ignore_conflicts=True
+        )
+        FeedItem.objects.follows_changed(user.id, added)
+        viewer_changed([user.id])
+        return Response(serializer.results(ids, statuses))
+
     @action(
         methods=['get'],
         detail=False,
         serializer_class=SubscribeSerializer,
         permission_classes=[IsAuthenticated],
-        pagination_class=CustomResultsPagination
+        pagination_class=OptionalCursorPagination
     )
     def subscriptions(self, request, *args, **kwargs):
+        """
+        Followed authors with recipes count and their latest recipes,
+        fetched for the whole page with one ROW_NUMBER() window query
+        """
         user = request.user
-        queryset = User.objects.filter(followings__user=user)
+        queryset = User.objects.filter(followings__user=user).annotate(
+            recipes_total=Count('recipes'),
+            subscribed=Value(True, output_field=BooleanField())
+        )
         page = self.paginate_queryset(queryset)
+        authors = list(queryset) if page is None else page
+        if authors:
+            prefetch_related_objects(authors, Prefetch(
+                'recipes',
+                queryset=self.latest_recipes(
+                    [author.pk for author in authors],
+                    get_recipes_limit(request)
+                ),
+                to_attr='recipes_preview'
+            ))
+        serializer = self.get_serializer(authors, many=True)
         if page is not None:
-            serializer = SubscribeSerializer(page, many=True)
             return self.get_paginated_response(serializer.data)
-
-        serializer = SubscribeSerializer(queryset, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    def latest_recipes(self, author_ids, limit):
+        """First `limit` recipes of every author, newest first"""
+        ranked = Recipe.objects.filter(author__in=author_ids).annotate(
+            recipe_rank=Window(
+                RowNumber(),
+                partition_by=[F('author')],
+                order_by=[F('pub_date').desc(), F('id').desc()]
+            )
+        ).order_by().values('id', 'recipe_rank')
+        sql, params = ranked.query.sql_with_params()
+        return Recipe.objects.filter(id__in=RawSQL(
+            'SELECT ranked.id FROM ({}) ranked '
+            'WHERE ranked.recipe_rank <= %s'.format(sql),
+            (*params, limit)
+        )).order_by('-pub_date', '-id')
+
 
 class UpdatePasswordAPIView(APIView):
     """An endpoint for changing password."""
@@ -2,8 +2,11 @@ from rest_framework.mixins import (CreateModelMixin, ListModelMixin,
                                    RetrieveModelMixin)
 from rest_framework.viewsets import GenericViewSet
 
+from foodgram.metrics import SerializationMetricsMixin
 
-class ModelCVViewSet(CreateModelMixin,
+
+class ModelCVViewSet(SerializationMetricsMixin,
+                     CreateModelMixin,
                      ListModelMixin,
                      RetrieveModelMixin,
                      GenericViewSet):